@@ -0,0 +1,88 @@
+"""
+Benchmark of the chunk ranking used by TextProcessor.
+
+Compares the sparse power-iteration TextRank in service.generators.ranking
+with the previous dense cosine_similarity + networkx PageRank on synthetic
+documents of 1k to 50k chunks. The dense version is skipped above
+DENSE_LIMIT chunks, where its n x n matrix no longer fits in memory.
+
+Usage:
+  python -m benchmarks.ranking_benchmark
+"""
+
+import random
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from service.generators.ranking import textrank_scores
+
+SIZES = [1000, 2000, 5000, 10000, 20000, 50000]
+DENSE_LIMIT = 2000
+VOCABULARY_SIZE = 20000
+WORDS_PER_CHUNK = 150
+TOP_K = 20
+
+
+def make_chunks(n: int, seed: int = 0):
+  rng = random.Random(seed)
+  vocabulary = [f'term{i}' for i in range(VOCABULARY_SIZE)]
+  # Zipf-like word frequencies, as in natural text
+  weights = [1 / (rank + 1) for rank in range(VOCABULARY_SIZE)]
+  topics = [rng.sample(vocabulary, 50) for _ in range(max(1, n // 100))]
+  chunks = []
+  for i in range(n):
+    words = rng.choices(vocabulary, weights=weights, k=WORDS_PER_CHUNK)
+    words += rng.choices(topics[i % len(topics)], k=WORDS_PER_CHUNK // 3)
+    chunks.append(' '.join(words))
+  return chunks
+
+
+def measure(fn):
+  tracemalloc.start()
+  start = time.perf_counter()
+  result = fn()
+  elapsed = time.perf_counter() - start
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return result, elapsed, peak / (1024 * 1024)
+
+
+def dense_pagerank(tfidf_matrix):
+  import networkx as nx
+
+  graph = nx.from_numpy_array(cosine_similarity(tfidf_matrix))
+  scores = nx.pagerank(graph)
+  return np.array([scores[i] for i in range(tfidf_matrix.shape[0])])
+
+
+def top_k(scores, k: int = TOP_K):
+  return set(np.argsort(-scores, kind='stable')[:k].tolist())
+
+
+def main():
+  print(f"{'chunks':>8} | {'sparse s':>9} | {'sparse MB':>9} | {'dense s':>9} | {'dense MB':>9} | {'top-' + str(TOP_K) + ' overlap':>14}")
+  print('-' * 74)
+  for n in SIZES:
+    tfidf_matrix = TfidfVectorizer(
+        stop_words='english').fit_transform(make_chunks(n))
+
+    sparse_scores, sparse_time, sparse_peak = measure(
+        lambda: textrank_scores(tfidf_matrix))
+
+    if n <= DENSE_LIMIT:
+      dense_scores, dense_time, dense_peak = measure(
+          lambda: dense_pagerank(tfidf_matrix))
+      overlap = len(top_k(sparse_scores) & top_k(dense_scores)) / TOP_K
+      dense = f"{dense_time:>9.2f} | {dense_peak:>9.1f} | {overlap:>14.0%}"
+    else:
+      dense = f"{'skipped':>9} | {'-':>9} | {'-':>14}"
+
+    print(f"{n:>8} | {sparse_time:>9.2f} | {sparse_peak:>9.1f} | {dense}")
+
+
+if __name__ == '__main__':
+  main()
@@ -1,14 +1,22 @@
-from fastapi import APIRouter, UploadFile
+from fastapi import APIRouter, UploadFile, Header
 from fastapi import BackgroundTasks
-from service.generators.service import pdf_processor, txt_file_processor, doc_processor, image_generator, link_generator, category_client
-from models.quizzes import add_quiz
+from service.generators.service import pdf_processor, txt_file_processor, doc_processor, image_generator, link_generator, file_uploader
+from service.generators.categorizer import categorizer
+from models.quizzes import add_quiz, create_quiz_draft, append_questions, finalize_quiz, delete_quiz
 from models.categories import get_all_categories
-from controllers.shared_resources import task_semaphore, task_results
+from controllers.shared_resources import scheduler, task_results, jobs, remove_temp_file
+from service.tasks.scheduler import priority_for_size
+from service.tasks.registry import idempotency_key
+from service.generators.cache import use_response_cache
+from service.generators.sink import QuestionSink, current_question_sink
+from service.generators.deadline import Deadline, current_deadline, GEN_TASK_BUDGET_SECONDS
 from pydantic import BaseModel
+from typing import Annotated, Optional
+import asyncio
 import os
 import tempfile
 import uuid
-import json
+import hashlib
 from controllers.document_controller import download_document_file
 
 router = APIRouter()
@@ -21,6 +29,8 @@ class TextRequest(BaseModel):
   count: int
   lang: str
   difficulty: str = "medium"
+  use_cache: bool = True
+  incremental: bool = False
 
 
 class LinkRequest(BaseModel):
@@ -30,51 +40,84 @@ class LinkRequest(BaseModel):
   count: int
   lang: str
   difficulty: str = "medium"
+  use_cache: bool = True
+  incremental: bool = False
+
+
+def request_key(header_key: Optional[str], user_id: str, *parts):
+  # An explicit Idempotency-Key header wins over the content hash
+  if header_key:
+    return idempotency_key("header", user_id, header_key)
+  return idempotency_key(user_id, *parts)
+
+
+def start_job(background_tasks: BackgroundTasks, key: str, fn, *args, on_cancel=None):
+  existing_task_id = jobs.find(key)
+  if existing_task_id:
+    return {"task_id": existing_task_id, "status": "processing", "deduplicated": True}
+
+  task_id = str(uuid.uuid4())
+  task_results[task_id] = {"status": "in_queue"}
+  jobs.register(task_id, key, on_cancel)
+
+  background_tasks.add_task(jobs.run, task_id, fn, *args, task_id)
+
+  return {"task_id": task_id, "status": "processing"}
+
+
+async def discard_upload(temp_file_path: str):
+  await file_uploader.release(temp_file_path)
+  remove_temp_file(temp_file_path)
 
 
 @router.post("/generate")
-async def gen(file: UploadFile, user_id: str, is_public: bool, count: int, lang: str, background_tasks: BackgroundTasks, difficulty: str = "medium"):
+async def gen(file: UploadFile, user_id: str, is_public: bool, count: int, lang: str, background_tasks: BackgroundTasks, difficulty: str = "medium", use_cache: bool = True, incremental: bool = False, idempotency_key_header: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None):
   filename = file.filename
   file_ext = os.path.splitext(filename)[1].lower()
+  content = await file.read()
+
+  key = request_key(idempotency_key_header, user_id, "generate", hashlib.sha256(
+      content).hexdigest(), file_ext, is_public, count, lang, difficulty)
+  existing_task_id = jobs.find(key)
+  if existing_task_id:
+    return {"task_id": existing_task_id, "status": "processing", "deduplicated": True}
 
   with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
     temp_file_path = tmp.name
-    content = await file.read()
     tmp.write(content)
 
-  task_id = str(uuid.uuid4())
+  result = start_job(background_tasks, key, process_file, temp_file_path, user_id, is_public, file_ext, count, lang, difficulty, use_cache, incremental,
+                     on_cancel=lambda: discard_upload(temp_file_path))
+  if result.get("deduplicated"):
+    # An identical request registered its job since the check above
+    remove_temp_file(temp_file_path)
+    return result
 
-  task_results[task_id] = {"status": "in_queue"}
+  # Only after the job is registered, so its cleanup releases the upload
+  if file_ext == '.pdf' and await asyncio.to_thread(pdf_processor.uses_file_upload, temp_file_path):
+    # Overlap the Gemini upload with the time the job waits in the queue
+    file_uploader.prefetch(temp_file_path)
 
-  background_tasks.add_task(
-      process_file, temp_file_path, user_id, is_public, file_ext, count, lang, difficulty, task_id)
-
-  return {"task_id": task_id, "status": "processing"}
+  return result
 
 
 @router.post("/generate/text")
-async def gen_from_text(request: TextRequest, background_tasks: BackgroundTasks):
-  task_id = str(uuid.uuid4())
-  task_results[task_id] = {"status": "in_queue"}
-
-  background_tasks.add_task(
-      process_text, request.text, request.user_id, request.is_public, request.count, request.lang, request.difficulty, task_id)
+async def gen_from_text(request: TextRequest, background_tasks: BackgroundTasks, idempotency_key_header: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None):
+  key = request_key(idempotency_key_header, request.user_id, "text", request.text,
+                    request.is_public, request.count, request.lang, request.difficulty)
 
-  return {"task_id": task_id, "status": "processing"}
+  return start_job(background_tasks, key, process_text, request.text, request.user_id, request.is_public, request.count, request.lang, request.difficulty, request.use_cache, request.incremental)
 
 
 @router.post("/generate/link")
-async def gen_from_link(request: LinkRequest, background_tasks: BackgroundTasks):
-  task_id = str(uuid.uuid4())
-  task_results[task_id] = {"status": "in_queue"}
+async def gen_from_link(request: LinkRequest, background_tasks: BackgroundTasks, idempotency_key_header: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None):
+  key = request_key(idempotency_key_header, request.user_id, "link", request.link,
+                    request.is_public, request.count, request.lang, request.difficulty)
 
-  background_tasks.add_task(
-      process_link, request.link, request.user_id, request.is_public, request.count, request.lang, request.difficulty, task_id)
+  return start_job(background_tasks, key, process_link, request.link, request.user_id, request.is_public, request.count, request.lang, request.difficulty, request.use_cache, request.incremental)
 
-  return {"task_id": task_id, "status": "processing"}
 
-
-async def process_document_download(document_id: str, user_id: str, is_public: bool, count: int, lang: str, difficulty: str, task_id: str):
+async def process_document_download(document_id: str, user_id: str, is_public: bool, count: int, lang: str, difficulty: str, use_cache: bool, incremental: bool, task_id: str):
   try:
     task_results[task_id] = {"status": "processing",
                              "message": f"Downloading {document_id}"}
@@ -88,7 +131,10 @@ async def process_document_download(document_id: str, user_id: str, is_public: b
       }
       return
 
-    await process_file(temp_file_path, user_id, is_public, '.' + file_ext, count, lang, difficulty, task_id)
+    if file_ext == 'pdf' and await asyncio.to_thread(pdf_processor.uses_file_upload, temp_file_path):
+      file_uploader.prefetch(temp_file_path)
+
+    await process_file(temp_file_path, user_id, is_public, '.' + file_ext, count, lang, difficulty, use_cache, incremental, task_id)
   except Exception as e:
     task_results[task_id] = {
         "status": "error",
@@ -104,13 +150,19 @@ async def generate_from_document(
     count: int,
     lang: str,
     background_tasks: BackgroundTasks,
-    difficulty: str = "medium"
+    difficulty: str = "medium",
+    use_cache: bool = True,
+    incremental: bool = False,
+    idempotency_key_header: Annotated[Optional[str], Header(
+        alias="Idempotency-Key")] = None
 ):
   try:
-    task_id = str(uuid.uuid4())
-    task_results[task_id] = {"status": "in_queue"}
+    key = request_key(idempotency_key_header, user_id, "document", document_id,
+                      is_public, count, lang, difficulty)
 
-    background_tasks.add_task(
+    return start_job(
+        background_tasks,
+        key,
         process_document_download,
         document_id,
         user_id,
@@ -118,10 +170,9 @@ async def generate_from_document(
         count,
         lang,
         difficulty,
-        task_id
+        use_cache,
+        incremental
     )
-
-    return {"task_id": task_id, "status": "processing"}
   except Exception as e:
     return {
         "status": "error",
@@ -129,127 +180,170 @@ async def generate_from_document(
     }
 
 
-async def select_categories_and_title(questions: list, categories: list) -> tuple[list[str], str]:
+async def save_quiz(generate, user_id: str, is_public: bool, count: int, difficulty: str, incremental: bool, task_id: str):
   """
-  Use AI to select relevant categories and generate a title for the quiz
-  Returns a tuple of (selected_categories, title)
+  Run `generate` and store its questions as a quiz.
+
+  The task progress counts questions as soon as they are parsed. In
+  incremental mode the quiz is inserted before generation starts and
+  every chunk's questions are appended to it (and exposed in the task
+  status) as soon as they are parsed, so a crash keeps what was generated.
   """
-  prompt = f"""
-    Given the following quiz questions and available categories, select the most relevant categories and generate a short, descriptive title for the quiz.
-    
-    Questions:
-    {json.dumps(questions, indent=2)}
-    
-    Available Categories:
-    {json.dumps(categories, indent=2)}
-    
-    Please respond in the following JSON format:
-    {{
-        "categories": ["category1", "category2", ...],  # Select 1-3 most relevant categories. Just select the categories in the list, no other text.
-        "title": "A short, descriptive title for the quiz"
-    }}
-    """
-
-  response = await category_client.model.generate_content_async(contents=prompt)
-  result = json.loads(response.text.replace('```json', '').replace('```', ''))
-
-  return result["categories"], result["title"]
-
-
-async def process_link(link: str, user_id: str, is_public: bool, count: int, lang: str, difficulty: str, task_id: str):
-  try:
-    async with task_semaphore:
-      task_results[task_id] = {"status": "processing",
-                               "progress": "Processing web link"}
+  if not incremental:
+    async def on_progress(questions):
+      task_results[task_id] = {
+          "status": "processing",
+          "progress": f"{len(progress.questions)}/{count} questions ready"
+      }
+
+    progress = QuestionSink(count, on_progress)
+    token = current_question_sink.set(progress)
+    try:
+      json_obj = await generate()
+    finally:
+      current_question_sink.reset(token)
+    if not json_obj.get("questions"):
+      task_results[task_id] = {"status": "error",
+                               "message": "No questions generated"}
+      return
 
-      json_obj = await link_generator.generate_questions(link, count, lang, task_id, difficulty)
+    await add_categories_and_title(json_obj, difficulty)
+    await add_quiz(json_obj, user_id, is_public)
+    task_results[task_id] = {"status": "completed", "result": json_obj}
+    return
 
-      if len(json_obj) > 0:
-        categories = await get_all_categories()
+  quiz_id = await create_quiz_draft(user_id, is_public, difficulty)
 
-        selected_categories, title = await select_categories_and_title(json_obj["questions"], categories)
+  async def on_questions(questions):
+    await append_questions(quiz_id, questions)
+    task_results[task_id] = {
+        "status": "processing",
+        "progress": f"{len(sink.questions)}/{count} questions ready",
+        "quiz_id": quiz_id,
+        "questions": list(sink.questions)
+    }
 
-        json_obj["categories"] = selected_categories
-        json_obj["title"] = title
-        json_obj["difficulty"] = difficulty
+  sink = QuestionSink(count, on_questions)
+  token = current_question_sink.set(sink)
+  try:
+    try:
+      generated = await generate()
+    finally:
+      current_question_sink.reset(token)
+
+    if not sink.questions:
+      await delete_quiz(quiz_id)
+      task_results[task_id] = {"status": "error",
+                               "message": "No questions generated"}
+      return
 
-        await add_quiz(json_obj, user_id, is_public)
-        task_results[task_id] = {"status": "completed", "result": json_obj}
+    json_obj = {"questions": sink.questions,
+                "title": (generated or {}).get("title")}
+    await add_categories_and_title(json_obj, difficulty)
+    await finalize_quiz(quiz_id, {
+        "categories": json_obj["categories"],
+        "title": json_obj["title"],
+        "difficulty": difficulty
+    })
+  except BaseException:
+    # Keep what was generated before the failure or cancellation, the draft
+    # must not stay hidden in 'generating'
+    try:
+      if sink.questions:
+        await finalize_quiz(quiz_id, {}, status="partial")
       else:
-        task_results[task_id] = {"status": "error",
-                                 "message": "No questions generated"}
+        await delete_quiz(quiz_id)
+    except Exception as e:
+      print(f"Error closing quiz draft {quiz_id}: {str(e)}")
+    raise
+  json_obj["_id"] = quiz_id
+  task_results[task_id] = {"status": "completed", "result": json_obj}
+
+
+async def add_categories_and_title(json_obj: dict, difficulty: str):
+  try:
+    categories = await get_all_categories()
+    selected_categories = await categorizer.assign(json_obj["questions"], categories)
+  except Exception as e:
+    # Categories are optional, the questions are still saved without them
+    print(f"Error categorizing quiz: {str(e)}")
+    selected_categories = []
+
+  json_obj["categories"] = selected_categories
+  # The title is written by the generation calls themselves
+  if not json_obj.get("title"):
+    json_obj["title"] = f"{selected_categories[0]} quiz" if selected_categories else "Quiz"
+  json_obj["difficulty"] = difficulty
+
+
+async def process_link(link: str, user_id: str, is_public: bool, count: int, lang: str, difficulty: str, use_cache: bool, incremental: bool, task_id: str):
+  use_response_cache.set(use_cache)
+  try:
+    async with scheduler.slot("generate", user_id, task_id):
+      current_deadline.set(Deadline(GEN_TASK_BUDGET_SECONDS))
+      task_results[task_id] = {"status": "processing",
+                               "progress": "Processing web link"}
+
+      async def generate():
+        return await link_generator.generate_questions(link, count, lang, task_id, difficulty)
+
+      await save_quiz(generate, user_id, is_public, count, difficulty, incremental, task_id)
   except Exception as e:
     import traceback
     traceback.print_exc()
     task_results[task_id] = {"status": "error", "message": str(e)}
 
 
-async def process_text(text: str, user_id: str, is_public: bool, count: int, lang: str, difficulty: str, task_id: str):
+async def process_text(text: str, user_id: str, is_public: bool, count: int, lang: str, difficulty: str, use_cache: bool, incremental: bool, task_id: str):
+  use_response_cache.set(use_cache)
   try:
-    async with task_semaphore:
+    async with scheduler.slot("generate", user_id, task_id):
+      current_deadline.set(Deadline(GEN_TASK_BUDGET_SECONDS))
       task_results[task_id] = {"status": "processing",
                                "progress": "Generating questions from text"}
 
-      json_obj = await txt_file_processor.generate_questions_from_text(text, count, lang, task_id, difficulty)
-
-      if len(json_obj) > 0:
-        categories = await get_all_categories()
-
-        selected_categories, title = await select_categories_and_title(json_obj["questions"], categories)
-
-        json_obj["categories"] = selected_categories
-        json_obj["title"] = title
-        json_obj["difficulty"] = difficulty
+      async def generate():
+        return await txt_file_processor.generate_questions_from_text(text, count, lang, task_id, difficulty)
 
-        await add_quiz(json_obj, user_id, is_public)
-        task_results[task_id] = {"status": "completed", "result": json_obj}
-      else:
-        task_results[task_id] = {"status": "error",
-                                 "message": "No questions generated"}
+      await save_quiz(generate, user_id, is_public, count, difficulty, incremental, task_id)
   except Exception as e:
     import traceback
     traceback.print_exc()
     task_results[task_id] = {"status": "error", "message": str(e)}
 
 
-async def process_file(temp_file_path, user_id, is_public, file_ext, count, lang, difficulty, task_id):
+async def process_file(temp_file_path, user_id, is_public, file_ext, count, lang, difficulty, use_cache, incremental, task_id):
+  use_response_cache.set(use_cache)
   try:
-    async with task_semaphore:
+    priority = priority_for_size(os.path.getsize(temp_file_path))
+    async with scheduler.slot("generate", user_id, task_id, priority):
+      current_deadline.set(Deadline(GEN_TASK_BUDGET_SECONDS))
       task_results[task_id] = {"status": "processing",
                                "progress": "Starting file processing"}
       print("Processing file: ", temp_file_path)
-      json_obj = {}
-      if file_ext == '.pdf':
-        json_obj = await pdf_processor.generate_questions(temp_file_path, count, lang, task_id, difficulty)
-      elif file_ext == '.docx' or file_ext == '.doc':
-        json_obj = await doc_processor.generate_questions_from_text(temp_file_path, count, lang, task_id, difficulty)
-      elif file_ext == '.md' or file_ext == '.txt':
-        json_obj = await txt_file_processor.generate_questions(temp_file_path, count, lang, task_id, difficulty)
-      elif file_ext in ['.png', '.jpg', '.jpeg']:
-        json_obj = await image_generator.generate_questions(temp_file_path, count, lang, task_id, difficulty)
-      else:
-        raise ValueError(f"Unsupported file type: {file_ext}")
-
-      print("Done generating questions")
-
-      if len(json_obj) > 0:
-        categories = await get_all_categories()
 
-        selected_categories, title = await select_categories_and_title(json_obj["questions"], categories)
-
-        json_obj["categories"] = selected_categories
-        json_obj["title"] = title
-        json_obj["difficulty"] = difficulty
-
-        await add_quiz(json_obj, user_id, is_public)
-        task_results[task_id] = {"status": "completed", "result": json_obj}
-      else:
-        task_results[task_id] = {"status": "error",
-                                 "message": "No questions generated"}
+      async def generate():
+        json_obj = {}
+        if file_ext == '.pdf':
+          json_obj = await pdf_processor.generate_questions(temp_file_path, count, lang, task_id, difficulty)
+        elif file_ext == '.docx' or file_ext == '.doc':
+          json_obj = await doc_processor.generate_questions_from_text(temp_file_path, count, lang, task_id, difficulty)
+        elif file_ext == '.md' or file_ext == '.txt':
+          json_obj = await txt_file_processor.generate_questions(temp_file_path, count, lang, task_id, difficulty)
+        elif file_ext in ['.png', '.jpg', '.jpeg']:
+          json_obj = await image_generator.generate_questions(temp_file_path, count, lang, task_id, difficulty)
+        else:
+          raise ValueError(f"Unsupported file type: {file_ext}")
+
+        print("Done generating questions")
+        return json_obj
+
+      await save_quiz(generate, user_id, is_public, count, difficulty, incremental, task_id)
   except Exception as e:
     import traceback
     traceback.print_exc()
     task_results[task_id] = {"status": "error", "message": str(e)}
   finally:
-    if os.path.exists(temp_file_path):
-      os.remove(temp_file_path)
+    # A prefetch started for the file may still be reading it
+    await file_uploader.release(temp_file_path)
+    remove_temp_file(temp_file_path)
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Form, UploadFile, BackgroundTasks
-from controllers.shared_resources import task_semaphore, task_results
+from controllers.shared_resources import scheduler, task_results, jobs, remove_temp_file
+from service.tasks.scheduler import priority_for_size
 from typing import Annotated
 from service.processors.service import query_document, process_pdf, process_docx, process_text_file, add_document
 from service.generators.base import upload_file
@@ -24,9 +25,11 @@ async def add_doc(file: UploadFile, user_id: str, is_public: bool, background_ta
     tmp.write(content)
 
   task_id = str(uuid.uuid4())
+  task_results[task_id] = {"status": "in_queue"}
+  jobs.register(task_id, on_cancel=lambda: remove_temp_file(temp_file_path))
 
   background_tasks.add_task(
-      process_file, temp_file_path, user_id, is_public, file_ext, task_id, mode, filename)
+      jobs.run, task_id, process_file, temp_file_path, user_id, is_public, file_ext, task_id, mode, filename)
 
   return {"task_id": task_id, "status": "processing"}
 
@@ -51,13 +54,16 @@ async def add_doc(file: UploadFile, user_id: str, is_public: bool, background_ta
 @router.post("/query")
 async def query(user_id: Annotated[str, Form()], query_text: Annotated[str, Form()], background_tasks: BackgroundTasks):
   task_id = str(uuid.uuid4())
-  background_tasks.add_task(get_query_result, query_text, user_id, task_id)
+  task_results[task_id] = {"status": "in_queue"}
+  jobs.register(task_id)
+  background_tasks.add_task(
+      jobs.run, task_id, get_query_result, query_text, user_id, task_id)
   return {"task_id": task_id, "status": "processing"}
 
 
 async def get_query_result(query_text: str, user_id: str, task_id):
   try:
-    async with task_semaphore:
+    async with scheduler.slot("query", user_id, task_id):
       task_results[task_id] = {"status": "processing"}
       resp = await query_document(query_text, user_id)
 
@@ -74,7 +80,7 @@ async def get_query_result(query_text: str, user_id: str, task_id):
 
 # async def process_upload_file(temp_file_path, user_id, is_public, filename, task_id):
 #   try:
-#     async with task_semaphore:
+#     async with scheduler.slot("ingest", user_id, task_id):
 #       task_results[task_id] = {"status": "uploading"}
 
 #       file_url = await upload_file(temp_file_path)
@@ -96,7 +102,8 @@ async def get_query_result(query_text: str, user_id: str, task_id):
 
 async def process_file(temp_file_path, user_id, is_public, file_ext, task_id, mode="text", filename=None):
   try:
-    async with task_semaphore:
+    priority = priority_for_size(os.path.getsize(temp_file_path))
+    async with scheduler.slot("ingest", user_id, task_id, priority):
 
       print(f'Adding document {temp_file_path} of {user_id}')
 
@@ -4,7 +4,7 @@ from bson import ObjectId
 from typing import Dict, Optional, List
 from datetime import datetime, time
 from pydantic import BaseModel, validator
-from controllers.shared_resources import task_semaphore, task_results
+from controllers.shared_resources import task_results
 import uuid
 
 router = APIRouter()
@@ -1,16 +1,108 @@
 import asyncio
-from fastapi import APIRouter
+import json
+import os
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from service.tasks.store import create_task_store
+from service.tasks.scheduler import JobScheduler
+from service.tasks.events import TaskEventBus
+from service.tasks.registry import JobRegistry
 
 router = APIRouter()
 
-MAX_CONCURRENT_TASKS = 3
-task_semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
+task_events = TaskEventBus()
+task_results = create_task_store(task_events)
+scheduler = JobScheduler(task_results)
+jobs = JobRegistry(task_results)
+
+
+def remove_temp_file(temp_file_path: str):
+  # Cleanup of jobs cancelled before they start, see JobRegistry.register
+  if os.path.exists(temp_file_path):
+    os.remove(temp_file_path)
+
+
+TERMINAL_STATUSES = {"completed", "error", "failed", "cancelled", "not_found"}
+
+# How long a stream waits for a local event before re-reading the shared
+# store, which is how updates of tasks running on another worker arrive
+STREAM_POLL_SECONDS = float(os.environ.get('STATUS_STREAM_POLL_SECONDS', '5'))
 
 
 @router.get("/status/{task_id}")
 async def get_status(task_id: str):
-  if task_id in task_results:
-    return task_results[task_id]
+  result = await task_results.fetch(task_id)
+  if result is not None:
+    return result
   return {"status": "not_found"}
 
-task_results = {}
+
+@router.delete("/status/{task_id}")
+async def cancel_task(task_id: str):
+  if jobs.cancel(task_id):
+    return {"status": "cancelled", "task_id": task_id}
+
+  result = await task_results.fetch(task_id)
+  if result is None:
+    return {"status": "not_found"}
+  if result.get("status") in TERMINAL_STATUSES:
+    return {"status": "error", "message": f"Task already {result['status']}"}
+  return {"status": "error", "message": "Task is running on another worker"}
+
+
+async def status_updates(task_id: str):
+  """
+  Yield every new status of a task until it reaches a terminal status.
+  None is yielded when nothing changed for STREAM_POLL_SECONDS so callers
+  can send a keep-alive.
+  """
+  with task_events.subscribe(task_id) as events:
+    current = await task_results.fetch(task_id)
+    last = None
+    while True:
+      if current is None:
+        current = {"status": "not_found"}
+
+      if current != last:
+        yield current
+        last = current
+      else:
+        yield None
+
+      if current.get("status") in TERMINAL_STATUSES:
+        return
+
+      try:
+        current = await asyncio.wait_for(events.get(), STREAM_POLL_SECONDS)
+      except asyncio.TimeoutError:
+        current = await task_results.fetch(task_id)
+
+
+@router.get("/status/{task_id}/stream")
+async def stream_status(task_id: str, request: Request):
+  async def event_source():
+    async for status in status_updates(task_id):
+      if await request.is_disconnected():
+        return
+      if status is None:
+        yield ": keep-alive\n\n"
+      else:
+        yield f"data: {json.dumps(status, default=str)}\n\n"
+
+  return StreamingResponse(
+      event_source(),
+      media_type="text/event-stream",
+      headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+  )
+
+
+@router.websocket("/status/{task_id}/ws")
+async def websocket_status(websocket: WebSocket, task_id: str):
+  await websocket.accept()
+  try:
+    async for status in status_updates(task_id):
+      if status is not None:
+        await websocket.send_text(json.dumps(status, default=str))
+    await websocket.close()
+  except WebSocketDisconnect:
+    pass
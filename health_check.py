@@ -16,10 +16,10 @@ async def test_gemini_connection():
       return False, "GOOGLE_GENAI_KEY not found in environment"
 
     client = GenAIClient(api_key=api_key)
-    response = await client.model.generate_content_async(contents="Say 'OK' if you can read this.")
+    response_text = await client.generate("Say 'OK' if you can read this.")
 
-    if response and response.text:
-      return True, f"Gemini API connected successfully (model: gemini-2.5-pro)"
+    if response_text:
+      return True, f"Gemini API connected successfully (model: {client.model.model_name})"
     else:
       return False, "Gemini API returned empty response"
 
@@ -64,6 +64,12 @@ async def startup_event():
   else:
     print("ℹ️  Startup tests disabled (set RUN_STARTUP_TESTS=true to enable)\n")
 
+
+@app.on_event("shutdown")
+async def shutdown_event():
+  from service.workers.pool import cpu_pool
+  cpu_pool.shutdown()
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
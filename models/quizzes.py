@@ -25,6 +25,57 @@ async def add_quiz(quiz, user_id: str, is_public: bool = True):
   return quiz
 
 
+async def create_quiz_draft(user_id: str, is_public: bool = True, difficulty: str = "medium"):
+  """
+  Insert an empty quiz that questions are appended to while they are being
+  generated. Drafts are hidden from search until they are finalized.
+  """
+  draft = {
+      'questions': [],
+      'categories': [],
+      'title': '',
+      'difficulty': difficulty,
+      'status': 'generating',
+      'user_id': user_id,
+      'is_public': is_public,
+      'created_date': datetime.now(timezone.utc),
+      'last_modified_date': datetime.now(timezone.utc),
+      'num_question': 0
+  }
+  result = await collection.insert_one(draft)
+  return str(result.inserted_id)
+
+
+async def append_questions(quiz_id: str, questions: list):
+  for question in questions:
+    if 'question_id' not in question:
+      question['question_id'] = str(ObjectId())
+
+  return await collection.update_one(
+      {'_id': ObjectId(quiz_id)},
+      {
+          '$push': {'questions': {'$each': questions}},
+          '$inc': {'num_question': len(questions)},
+          '$set': {'last_modified_date': datetime.now(timezone.utc)}
+      }
+  )
+
+
+async def finalize_quiz(quiz_id: str, update_data: dict, status: Optional[str] = None):
+  """
+  Set the final fields of a draft. Without a status the quiz becomes a
+  regular quiz, otherwise it keeps the given status (e.g. 'partial').
+  """
+  update_data['last_modified_date'] = datetime.now(timezone.utc)
+  update = {'$set': update_data}
+  if status is None:
+    update['$unset'] = {'status': ''}
+  else:
+    update_data['status'] = status
+
+  return await collection.update_one({'_id': ObjectId(quiz_id)}, update)
+
+
 async def update_quiz(quiz_id: str, update_data: dict):
   update_data['last_modified_date'] = datetime.now(timezone.utc)
 
@@ -81,6 +132,8 @@ async def search_quizzes(
     if is_public is not None:
       query['is_public'] = is_public
 
+  query['status'] = {'$ne': 'generating'}
+
   if min_created_date or max_created_date:
     created_date_query = {}
     if min_created_date:
@@ -146,6 +199,8 @@ async def count_quizzes(
     if is_public is not None:
       query['is_public'] = is_public
 
+  query['status'] = {'$ne': 'generating'}
+
   if min_created_date or max_created_date:
     query["created_date"] = {}
     if min_created_date:
@@ -0,0 +1,50 @@
+from models.mongo import mongo_database
+from datetime import datetime, timezone, timedelta
+
+collection = mongo_database['tasks']
+
+_indexes_ready = False
+
+
+async def ensure_indexes():
+  global _indexes_ready
+  if _indexes_ready:
+    return
+  # Mongo's TTL monitor removes the document once expires_at has passed
+  await collection.create_index('expires_at', expireAfterSeconds=0)
+  _indexes_ready = True
+
+
+async def save_task(task_id: str, value: dict, ttl_seconds: int):
+  await ensure_indexes()
+  now = datetime.now(timezone.utc)
+  await collection.update_one(
+      {'_id': task_id},
+      {'$set': {
+          'value': value,
+          'updated_at': now,
+          'expires_at': now + timedelta(seconds=ttl_seconds)
+      }},
+      upsert=True
+  )
+
+
+async def get_task(task_id: str):
+  task = await collection.find_one({'_id': task_id})
+  if not task:
+    return None
+
+  expires_at = task.get('expires_at')
+  if expires_at is not None:
+    if expires_at.tzinfo is None:
+      expires_at = expires_at.replace(tzinfo=timezone.utc)
+    # The TTL monitor only runs once a minute, so double check here
+    if expires_at <= datetime.now(timezone.utc):
+      return None
+
+  return task.get('value')
+
+
+async def delete_task(task_id: str):
+  result = await collection.delete_one({'_id': task_id})
+  return result.deleted_count > 0
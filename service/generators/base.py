@@ -1,5 +1,4 @@
 import google.generativeai as old_genai
-import json
 from catboxpy import AsyncCatboxClient
 from google import genai
 from google.genai import types
@@ -7,51 +6,239 @@ import asyncio
 import pathlib
 import os
 import tempfile
+import hashlib
+import time
+from datetime import datetime, timezone
+from service.generators.limiter import gemini_limiter, estimate_tokens, is_rate_limit_error, is_transient_error
+from service.generators.routing import model_router, GEMINI_FALLBACK_AFTER_RETRIES
+from service.generators.cache import response_cache, use_response_cache, cache_key
+from service.generators.parsing import parse_questions
+from service.generators.context_cache import context_cache, as_parts
+
+# Uploaded files are reused until they are this close to their expiry
+GEMINI_FILE_REUSE_MARGIN_SECONDS = int(
+    os.environ.get('GEMINI_FILE_REUSE_MARGIN_SECONDS', '3600'))
+GEMINI_FILE_IDLE_SECONDS = int(
+    os.environ.get('GEMINI_FILE_IDLE_SECONDS', str(6 * 60 * 60)))
+GEMINI_FILE_GC_INTERVAL_SECONDS = int(
+    os.environ.get('GEMINI_FILE_GC_INTERVAL_SECONDS', '600'))
 
 
 class GenAIClient:
-  def __init__(self, api_key: str, default_prompt: str = ''):
+  def __init__(self, api_key: str, default_prompt: str = '', generation_config: dict = None, stage: str = 'default'):
     old_genai.configure(api_key=api_key)
+    self.system_instruction = default_prompt
+    self.generation_config = generation_config
+    # Pipeline stage, picks the model in service.generators.routing
+    self.stage = stage
+    self._models = {}
+    self.model = self.get_model(model_router.model_for(stage))
+
+  def get_model(self, model_name: str):
+    model = self._models.get(model_name)
+    if model is None:
+      if len(self.system_instruction) > 0:
+        model = old_genai.GenerativeModel(
+            model_name, system_instruction=self.system_instruction, generation_config=self.generation_config)
+      else:
+        model = old_genai.GenerativeModel(
+            model_name, generation_config=self.generation_config)
+      self._models[model_name] = model
+    return model
+
+  async def generate(self, contents, timeout: float = None, validate=None, stream_to=None, document=None, difficulty: str = None):
+    """
+    Generate a response text. Identical requests are answered from the
+    response cache; `validate` can reject a response from being cached.
+
+    With `stream_to` the response is streamed: every attempt calls
+    `stream_to()` for a callback that is awaited with each piece of text.
+
+    `document` is sent before `contents`, from a Gemini context cache when
+    it is big enough, so calls on the same document only send `contents`.
+
+    The model is routed by stage, `difficulty` and input size. When it is
+    overloaded the call falls back to the next model of the route.
+    """
+    full_contents = contents
+    if document is not None:
+      full_contents = as_parts(document) + as_parts(contents)
+    estimated_tokens = estimate_tokens(full_contents)
+    models = model_router.route(self.stage, difficulty, estimated_tokens)
 
-    if len(default_prompt) > 0:
-      self.model = old_genai.GenerativeModel(
-          'gemini-2.5-pro', system_instruction=default_prompt)
+    key = None
+    if response_cache.enabled and use_response_cache.get():
+      key = cache_key(self.get_model(models[0]).model_name,
+                      self.system_instruction, full_contents)
+      cached = await response_cache.get(key)
+      if cached is not None:
+        if stream_to is not None:
+          await stream_to()(cached)
+        return cached
+
+    for i, model_name in enumerate(models):
+      last = i == len(models) - 1
+      try:
+        text = await self._generate_with(
+            self.get_model(model_name), contents, full_contents, document, estimated_tokens, timeout, stream_to,
+            None if last else GEMINI_FALLBACK_AFTER_RETRIES
+        )
+        break
+      except Exception as e:
+        if last or not (is_rate_limit_error(e) or is_transient_error(e)):
+          raise
+        print(
+            f"{model_name} unavailable ({type(e).__name__}), falling back to {models[i + 1]}")
+
+    if key is not None and (validate is None or validate(text)):
+      await response_cache.set(key, text)
+    return text
+
+  async def _generate_with(self, model, contents, full_contents, document, estimated_tokens: int, timeout: float, stream_to, max_retries: int):
+    request_contents = full_contents
+    if document is not None:
+      cached_model = await context_cache.model_for(self, model, document)
+      if cached_model is not None:
+        model = cached_model
+        request_contents = contents
+
+    if stream_to is None:
+      request = lambda: model.generate_content_async(contents=request_contents)
     else:
-      self.model = old_genai.GenerativeModel('gemini-2.5-pro')
+      request = lambda: self._stream(model, request_contents, stream_to())
+
+    # Every Gemini call goes through the shared limiter
+    response = await gemini_limiter.call(
+        request,
+        estimated_tokens,
+        timeout,
+        max_retries
+    )
+    return response.text
+
+  async def _stream(self, model, contents, on_text):
+    response = await model.generate_content_async(contents=contents, stream=True)
+    async for chunk in response:
+      try:
+        text = chunk.text
+      except ValueError:
+        # Chunks without text parts, e.g. the final finish reason
+        continue
+      await on_text(text)
+    return response
+
+
+def file_sha256(file_path: str):
+  digest = hashlib.sha256()
+  with open(file_path, 'rb') as f:
+    for block in iter(lambda: f.read(1024 * 1024), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+class UploadedFile:
+  def __init__(self, file):
+    self.file = file
+    self.last_used = time.monotonic()
+
+  def is_reusable(self):
+    expiration_time = getattr(self.file, 'expiration_time', None)
+    if expiration_time is None:
+      return True
+    if expiration_time.tzinfo is None:
+      expiration_time = expiration_time.replace(tzinfo=timezone.utc)
+    remaining = (expiration_time - datetime.now(timezone.utc)).total_seconds()
+    return remaining > GEMINI_FILE_REUSE_MARGIN_SECONDS
 
 
 class FileUploader(GenAIClient):
-  async def upload_pdf(self, pdf_path: str):
-    return await asyncio.to_thread(old_genai.upload_file, pdf_path)
+  """
+  Uploads files to the Gemini File API once per content hash and reuses the
+  remote file until it is about to expire. Files that have not been used
+  for GEMINI_FILE_IDLE_SECONDS, or that expired, are deleted remotely.
+  """
 
-# TODO: Update when error occurred to another chars (" for example)
+  def __init__(self, api_key: str, default_prompt: str = ''):
+    super().__init__(api_key, default_prompt)
+    self._files = {}
+    self._uploads = {}
+    self._prefetches = {}
+    self._last_collect = time.monotonic()
+
+  def prefetch(self, pdf_path: str):
+    """
+    Start uploading as soon as a file arrives, a later upload_pdf of the
+    same content waits for this upload instead of starting another one.
+    """
+    task = asyncio.ensure_future(self.upload_pdf(pdf_path))
+    self._prefetches[pdf_path] = task
+
+    def log_error(task):
+      if self._prefetches.get(pdf_path) is task:
+        del self._prefetches[pdf_path]
+      if not task.cancelled() and task.exception() is not None:
+        print(f"Error prefetching {pdf_path}: {str(task.exception())}")
 
+    task.add_done_callback(log_error)
+    return task
+
+  async def release(self, pdf_path: str):
+    """
+    Wait until a prefetch of `pdf_path` no longer reads the file, so it can
+    be removed. The prefetch is not cancelled: its hashing and upload run in
+    threads that would keep reading the file anyway.
+    """
+    task = self._prefetches.get(pdf_path)
+    if task is not None:
+      await asyncio.wait([task])
+
+  async def upload_pdf(self, pdf_path: str):
+    sha256 = await asyncio.to_thread(file_sha256, pdf_path)
 
-def load_json(json_string):
-  return json.loads(json_string)
-  # return json.loads(json_string.replace('\\', '\\\\'))
+    entry = self._files.get(sha256)
+    if entry is not None and entry.is_reusable():
+      entry.last_used = time.monotonic()
+      return entry.file
 
+    upload = self._uploads.get(sha256)
+    if upload is None:
+      upload = asyncio.ensure_future(self._upload(sha256, pdf_path))
+      self._uploads[sha256] = upload
+    # Shielded, a cancelled job must not abort an upload others wait for
+    return await asyncio.shield(upload)
 
-def fix_json_array(jsons):
-  print('received=', jsons)
-  questions = []
-  for subquestion in jsons:
-    subquestion = subquestion.replace('```json', '').replace('```', '')
-    print(subquestion)
-    data = load_json(subquestion)
-    print(data)
+  async def _upload(self, sha256: str, pdf_path: str):
+    try:
+      file = await asyncio.to_thread(old_genai.upload_file, pdf_path)
+      stale = self._files.get(sha256)
+      self._files[sha256] = UploadedFile(file)
+      if stale is not None:
+        await self._delete_remote(stale.file)
+      return file
+    finally:
+      self._uploads.pop(sha256, None)
+      if time.monotonic() - self._last_collect > GEMINI_FILE_GC_INTERVAL_SECONDS:
+        asyncio.ensure_future(self.collect_garbage())
 
-    for item in data['questions']:
-      questions.append({
-          "question": item["question"],
-          "options": item["options"],
-          "answer": item["answer"],
-          "explanation": item["explanation"]
-      })
+  async def _delete_remote(self, file):
+    try:
+      await asyncio.to_thread(old_genai.delete_file, file.name)
+    except Exception as e:
+      print(f"Error deleting Gemini file {file.name}: {str(e)}")
 
-  merged = {"questions": questions}
+  async def collect_garbage(self):
+    self._last_collect = time.monotonic()
+    now = time.monotonic()
+    stale = [
+        sha256 for sha256, entry in self._files.items()
+        if not entry.is_reusable() or now - entry.last_used > GEMINI_FILE_IDLE_SECONDS
+    ]
+    for sha256 in stale:
+      entry = self._files.pop(sha256)
+      await self._delete_remote(entry.file)
 
-  return merged
+def has_questions(json_string):
+  return len(parse_questions(json_string).questions) > 0
 
 
 async def upload_file(file_path: str):
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from service.generators.disk_store import DiskStore
+
+RESPONSE_CACHE_ENABLED = os.environ.get(
+    'RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_DIR = os.environ.get(
+    'RESPONSE_CACHE_DIR', os.path.join('.cache', 'responses'))
+RESPONSE_CACHE_MEMORY_ITEMS = int(
+    os.environ.get('RESPONSE_CACHE_MEMORY_ITEMS', '512'))
+RESPONSE_CACHE_DISK_MB = int(os.environ.get('RESPONSE_CACHE_DISK_MB', '512'))
+
+# Set to False by a job to bypass the cache for all of its Gemini calls
+use_response_cache = ContextVar('use_response_cache', default=True)
+
+
+def _update_with_part(digest, part):
+  if isinstance(part, str):
+    digest.update(b'text:')
+    digest.update(hashlib.sha256(part.encode('utf-8')).digest())
+  elif isinstance(part, (bytes, bytearray)):
+    digest.update(b'bytes:')
+    digest.update(hashlib.sha256(part).digest())
+  elif isinstance(part, dict):
+    digest.update(b'blob:' + str(part.get('mime_type')).encode('utf-8'))
+    _update_with_part(digest, part.get('data', part.get('text', '')))
+  elif isinstance(part, (list, tuple)):
+    digest.update(b'list:')
+    for item in part:
+      _update_with_part(digest, item)
+  else:
+    # File API reference, identified by the hash Gemini computed on upload
+    identity = getattr(part, 'sha256_hash', None) or getattr(
+        part, 'uri', None) or getattr(part, 'name', None) or repr(part)
+    digest.update(b'file:' + str(identity).encode('utf-8'))
+
+
+def cache_key(model_name: str, system_instruction, contents):
+  digest = hashlib.sha256()
+  digest.update(f'model:{model_name}'.encode('utf-8'))
+  _update_with_part(digest, system_instruction or '')
+  _update_with_part(digest, contents)
+  return digest.hexdigest()
+
+
+class ResponseCache:
+  """
+  Two tier cache of Gemini response texts keyed by `cache_key`.
+
+  Hits are served from an in-memory LRU first, then from a DiskStore shared
+  by every worker of the box.
+  """
+
+  def __init__(self, directory: str, memory_items: int, disk_bytes: int, enabled: bool = True):
+    self.memory_items = memory_items
+    self.enabled = enabled
+    self._memory = OrderedDict()
+    self._disk = DiskStore(directory, disk_bytes, '.txt')
+    self._lock = threading.Lock()
+
+  def _memory_get(self, key: str):
+    with self._lock:
+      value = self._memory.get(key)
+      if value is not None:
+        self._memory.move_to_end(key)
+      return value
+
+  def _memory_set(self, key: str, value: str):
+    with self._lock:
+      self._memory[key] = value
+      self._memory.move_to_end(key)
+      while len(self._memory) > self.memory_items:
+        self._memory.popitem(last=False)
+
+  def _disk_get(self, key: str):
+    data = self._disk.get(key)
+    return data.decode('utf-8') if data is not None else None
+
+  def _disk_set(self, key: str, value: str):
+    self._disk.set(key, value.encode('utf-8'))
+
+  async def get(self, key: str):
+    value = self._memory_get(key)
+    if value is not None:
+      return value
+
+    value = await asyncio.to_thread(self._disk_get, key)
+    if value is not None:
+      self._memory_set(key, value)
+    return value
+
+  async def set(self, key: str, value: str):
+    self._memory_set(key, value)
+    try:
+      await asyncio.to_thread(self._disk_set, key, value)
+    except OSError as e:
+      print(f"Error writing response cache: {str(e)}")
+
+
+response_cache = ResponseCache(
+    RESPONSE_CACHE_DIR,
+    RESPONSE_CACHE_MEMORY_ITEMS,
+    RESPONSE_CACHE_DISK_MB * 1024 * 1024,
+    RESPONSE_CACHE_ENABLED
+)
@@ -0,0 +1,82 @@
+import asyncio
+import os
+
+import google.generativeai as old_genai
+import numpy as np
+
+from service.generators.limiter import gemini_limiter, estimate_tokens
+
+CATEGORY_EMBEDDING_MODEL = os.environ.get(
+    'CATEGORY_EMBEDDING_MODEL', 'models/text-embedding-004')
+CATEGORY_MAX = int(os.environ.get('CATEGORY_MAX', '3'))
+# Categories scoring within this margin of the best one are kept as well
+CATEGORY_SIMILARITY_MARGIN = float(
+    os.environ.get('CATEGORY_SIMILARITY_MARGIN', '0.03'))
+
+# Texts per embedding request, and questions embedded per quiz
+EMBEDDING_BATCH_SIZE = 100
+
+
+def question_text(question: dict):
+  # Explanations mostly repeat the answer, the options carry the topic
+  return question['question'] + '\n' + '\n'.join(question.get('options', []))
+
+
+def normalize(vectors):
+  norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+  return vectors / np.maximum(norms, 1e-12)
+
+
+class Categorizer:
+  """
+  Assigns quiz categories by cosine similarity between the mean embedding
+  of the questions and the embeddings of the category names. Category
+  embeddings are computed once and kept in memory, so a quiz costs a
+  single embedding request instead of a generation call.
+  """
+
+  def __init__(self, model_name: str = CATEGORY_EMBEDDING_MODEL, max_categories: int = CATEGORY_MAX, margin: float = CATEGORY_SIMILARITY_MARGIN):
+    self.model_name = model_name
+    self.max_categories = max_categories
+    self.margin = margin
+    self._category_vectors = {}
+
+  async def embed(self, texts: list):
+    vectors = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+      batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+      result = await gemini_limiter.call(
+          lambda batch=batch: asyncio.to_thread(
+              old_genai.embed_content,
+              model=self.model_name,
+              content=batch,
+              task_type='classification'
+          ),
+          estimate_tokens(batch)
+      )
+      vectors.extend(result['embedding'])
+    return normalize(np.array(vectors, dtype=np.float32))
+
+  async def category_vectors(self, categories: list):
+    missing = [name for name in categories if name not in self._category_vectors]
+    if missing:
+      for name, vector in zip(missing, await self.embed(missing)):
+        self._category_vectors[name] = vector
+    return np.array([self._category_vectors[name] for name in categories])
+
+  async def assign(self, questions: list, categories: list):
+    if not questions or not categories:
+      return []
+
+    category_vectors = await self.category_vectors(categories)
+    question_vectors = await self.embed(
+        [question_text(question) for question in questions[:EMBEDDING_BATCH_SIZE]])
+    quiz_vector = normalize(question_vectors.mean(axis=0))
+
+    scores = category_vectors @ quiz_vector
+    order = np.argsort(-scores, kind='stable')[:self.max_categories]
+    best = scores[order[0]]
+    return [categories[i] for i in order if scores[i] >= best - self.margin]
+
+
+categorizer = Categorizer()
@@ -1,6 +1,7 @@
 import json
 
 question_example = {
+    "title": "Basic Spanish vocabulary",
     "questions": [
         {
             "question": "Which of the following is the correct translation of house in Spanish?",
@@ -18,13 +19,36 @@ multiple_choice_example = {
     "explanation": "Explain why you choose that answer"
 }
 
+# Structured output schema of the question generation responses
+question_response_schema = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "questions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "question": {"type": "string"},
+                    "options": {"type": "array", "items": {"type": "string"}},
+                    "answer": {"type": "integer"},
+                    "explanation": {"type": "string"}
+                },
+                "required": ["question", "options", "answer", "explanation"]
+            }
+        }
+    },
+    "required": ["title", "questions"]
+}
+
 # TODO: Remove multiple_choice_example and question_example from system prompt, and move it into the user prompt
 
 # default_prompt = f"""
 # """
 
 default_prompt = f"""
-You are an assistant specialized in generating challenging exam-style questions and answers. Your response must only be a JSON object with the following property:
+You are an assistant specialized in generating challenging exam-style questions and answers. Your response must only be a JSON object with the following properties:
+"title": A short, descriptive title for a quiz made of the generated questions, in the same language as the questions.
 "questions": An array of JSON objects, where each JSON object represents a question and answer pair. The JSON object representing the question must have the following properties:
 
 {json.dumps(multiple_choice_example, indent=2)}
@@ -115,27 +139,44 @@ All these rules apply to both the generated questions and answers.
 Focus on testing understanding and critical thinking while staying true to the source content."""
 
 
-def get_user_prompt_text(lang: str, count: int, text: str, difficulty: str = "medium"):
-  return default_prompt + '\n' + f"""
-Now generate {count} insightful questions based on the following content that tests understanding of key concepts or important details. The questions should be of {difficulty} difficulty level:
+# The instructions of default_prompt are the system instruction of the
+# question generator, user prompts only carry the per-call request. The
+# document comes first so Gemini context caches can hold it.
 
-<Begin Document>
+
+def get_text_document(text: str):
+  return f"""<Begin Document>
 "{text}"
 <End Document>
+"""
 
+
+def get_user_prompt_text(lang: str, count: int, difficulty: str = "medium"):
+  return f"""
+Now generate {count} insightful questions based on the document above that tests understanding of key concepts or important details. The questions should be of {difficulty} difficulty level.
 The generated questions and answers must be in {lang}. However, your response must still follow the JSON format provided before. This means that while the values should be in {lang}, the keys must be the exact same as given before, in English.
 """
 
 
 def get_user_prompt_images(lang: str, count: int, difficulty: str = "medium"):
-  return default_prompt + '\n' + f"""
+  return f"""
 Now read carefully the contents written on these images, then generate {count} insightful questions that tests understanding of key concepts or important details. The questions should be of {difficulty} difficulty level.
 The generated questions and answers must be in {lang}. However, your response must still follow the JSON format provided before. This means that while the values should be in {lang}, the keys must be the exact same as given before, in English.
 """
 
 
 def get_user_prompt_file(lang: str, count: int, difficulty: str = "medium"):
-  return default_prompt + '\n' + f"""
+  return f"""
 Now read carefully the contents written on this document, then generate {count} insightful questions that tests understanding of key concepts or important details. The questions should be of {difficulty} difficulty level.
 The generated questions and answers must be in {lang}. However, your response must still follow the JSON format provided before. This means that while the values should be in {lang}, the keys must be the exact same as given before, in English.
 """
+
+
+def get_topup_instruction(questions: list):
+  if not questions:
+    return ''
+  asked = '\n'.join(f"- {question['question']}" for question in questions)
+  return f"""
+These questions were already generated from this content, do not repeat them or ask about the exact same detail:
+{asked}
+"""
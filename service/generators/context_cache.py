@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import google.generativeai as old_genai
+from google.generativeai import caching
+
+from service.generators.cache import cache_key
+from service.generators.limiter import gemini_limiter, estimate_tokens, is_rate_limit_error, is_transient_error
+
+GEMINI_CONTEXT_CACHE_ENABLED = os.environ.get(
+    'GEMINI_CONTEXT_CACHE_ENABLED', 'true').lower() == 'true'
+# Gemini refuses explicit caches of fewer tokens than the model minimum
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(
+    os.environ.get('GEMINI_CONTEXT_CACHE_MIN_TOKENS', '4096'))
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(
+    os.environ.get('GEMINI_CONTEXT_CACHE_TTL_SECONDS', '900'))
+# Caches this close to their expiry are recreated instead of reused
+CONTEXT_CACHE_MARGIN_SECONDS = 60
+
+
+def as_parts(contents):
+  return list(contents) if isinstance(contents, (list, tuple)) else [contents]
+
+
+class ContextCache:
+  """
+  Gemini explicit context caches holding the system instruction and a
+  document (text chunks, page images or an uploaded file), keyed by content
+  hash. The retries and top-ups of a task then only send their short
+  instructions. A cache is only created when a document is sent a second
+  time within the TTL, as creating one for a single call costs more than it
+  saves. Caches expire remotely after their TTL, so nothing has to be
+  deleted.
+  """
+
+  def __init__(self, enabled: bool, min_tokens: int, ttl_seconds: int):
+    self.enabled = enabled
+    self.min_tokens = min_tokens
+    self.ttl_seconds = ttl_seconds
+    self._caches = {}
+    self._creating = {}
+    self._failed = set()
+    # Key -> monotonic time of the first use of a document not cached yet
+    self._sent = {}
+
+  @staticmethod
+  def _is_fresh(cached):
+    expire_time = getattr(cached, 'expire_time', None)
+    if expire_time is None:
+      return False
+    if expire_time.tzinfo is None:
+      expire_time = expire_time.replace(tzinfo=timezone.utc)
+    remaining = (expire_time - datetime.now(timezone.utc)).total_seconds()
+    return remaining > CONTEXT_CACHE_MARGIN_SECONDS
+
+  def _sent_before(self, key: str):
+    now = time.monotonic()
+    for stale in [k for k, sent in self._sent.items() if now - sent > self.ttl_seconds]:
+      del self._sent[stale]
+    if key in self._sent:
+      return True
+    self._sent[key] = now
+    return False
+
+  async def model_for(self, client, model, document):
+    """
+    Return `model` reading `document` from a context cache, or None when
+    the document is too small to be cached, is sent for the first time or
+    caching failed.
+    """
+    if not self.enabled or estimate_tokens(document) < self.min_tokens:
+      return None
+
+    key = cache_key(model.model_name, client.system_instruction, document)
+    if key in self._failed:
+      return None
+
+    cached = self._caches.get(key)
+    if cached is None or not self._is_fresh(cached):
+      creation = self._creating.get(key)
+      if creation is None and cached is None and not self._sent_before(key):
+        return None
+      if creation is None:
+        creation = asyncio.ensure_future(
+            self._create(key, client, model, document))
+        self._creating[key] = creation
+      try:
+        # Shielded, a cancelled call must not abort a creation others wait for
+        cached = await asyncio.shield(creation)
+      except Exception as e:
+        print(f"Context caching failed, sending the document inline: {str(e)}")
+        if not (is_rate_limit_error(e) or is_transient_error(e)):
+          # E.g. a model without caching support, do not retry every call
+          self._failed.add(key)
+        return None
+
+    return old_genai.GenerativeModel.from_cached_content(
+        cached_content=cached, generation_config=client.generation_config)
+
+  async def _create(self, key: str, client, model, document):
+    try:
+      cached = await gemini_limiter.call(
+          lambda: asyncio.to_thread(
+              caching.CachedContent.create,
+              model=model.model_name,
+              system_instruction=client.system_instruction or None,
+              contents=as_parts(document),
+              ttl=timedelta(seconds=self.ttl_seconds)
+          ),
+          estimate_tokens(document)
+      )
+      self._caches[key] = cached
+      self._sent.pop(key, None)
+      for stale in [k for k, c in self._caches.items() if not self._is_fresh(c)]:
+        del self._caches[stale]
+      return cached
+    finally:
+      self._creating.pop(key, None)
+
+
+context_cache = ContextCache(
+    GEMINI_CONTEXT_CACHE_ENABLED,
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS,
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS
+)
@@ -0,0 +1,33 @@
+import os
+import time
+from contextvars import ContextVar
+
+# Wall-clock budget of the question generation of one task
+GEN_TASK_BUDGET_SECONDS = float(
+    os.environ.get('GEN_TASK_BUDGET_SECONDS', '1200'))
+# Retries of a single failed or empty generation call
+GEN_CALL_RETRIES = int(os.environ.get('GEN_CALL_RETRIES', '2'))
+GEN_RETRY_BACKOFF_SECONDS = float(
+    os.environ.get('GEN_RETRY_BACKOFF_SECONDS', '2'))
+# Rounds of top-up calls asking for the questions still missing
+GEN_TOPUP_ROUNDS = int(os.environ.get('GEN_TOPUP_ROUNDS', '3'))
+
+
+class Deadline:
+  def __init__(self, seconds: float):
+    self.expires_at = time.monotonic() + seconds
+
+  def remaining(self):
+    return max(0.0, self.expires_at - time.monotonic())
+
+  @property
+  def expired(self):
+    return self.remaining() <= 0
+
+
+# Set by a job once it starts running, so queueing time is not counted
+current_deadline = ContextVar('current_deadline', default=None)
+
+
+def get_deadline():
+  return current_deadline.get() or Deadline(GEN_TASK_BUDGET_SECONDS)
@@ -0,0 +1,110 @@
+import os
+import re
+import zlib
+
+import numpy as np
+
+# Estimated Jaccard similarity of the question shingles above which two
+# questions are considered the same
+QUESTION_DEDUP_THRESHOLD = float(
+    os.environ.get('QUESTION_DEDUP_THRESHOLD', '0.7'))
+# Questions with a stem shorter than this many characters are only the same
+# above QUESTION_DEDUP_SHORT_THRESHOLD, a few characters change their meaning
+QUESTION_DEDUP_SHORT_STEM = int(
+    os.environ.get('QUESTION_DEDUP_SHORT_STEM', '40'))
+QUESTION_DEDUP_SHORT_THRESHOLD = float(
+    os.environ.get('QUESTION_DEDUP_SHORT_THRESHOLD', '0.9'))
+
+SHINGLE_SIZE = 4
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+def shingles(text: str):
+  # Character shingles work for every language the questions are asked in
+  text = ' '.join(re.findall(r'\w+', text.lower()))
+  if len(text) <= SHINGLE_SIZE:
+    return {text}
+  return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def question_text(question: dict):
+  """
+  Stem, options and answer of a question. The options are sorted, so the
+  same question with shuffled options is still a duplicate, and the answer
+  tells apart questions whose options are the same.
+  """
+  options = question.get('options') or []
+  answer = question.get('answer')
+  if isinstance(answer, int) and 0 <= answer < len(options):
+    answer = options[answer]
+  parts = [str(question.get('question', ''))]
+  parts.extend(sorted(str(option) for option in options))
+  parts.append('' if answer is None else str(answer))
+  return '\n'.join(parts)
+
+
+class QuestionDeduplicator:
+  """
+  Detects near-duplicate questions with MinHash signatures of the character
+  shingles of their stem, options and answer and an LSH index of `bands` bands, so adding a
+  question costs O(1) lookups instead of comparing it with every kept one.
+  Candidates sharing a band are confirmed with the estimated Jaccard
+  similarity, which must be higher when either stem is short.
+  """
+
+  def __init__(self, threshold: float = QUESTION_DEDUP_THRESHOLD, num_perm: int = 64, bands: int = 16, seed: int = 1,
+               short_stem: int = QUESTION_DEDUP_SHORT_STEM, short_threshold: float = QUESTION_DEDUP_SHORT_THRESHOLD):
+    if num_perm % bands != 0:
+      raise ValueError('num_perm must be a multiple of bands')
+    rng = np.random.default_rng(seed)
+    self.threshold = threshold
+    self.short_stem = short_stem
+    self.short_threshold = max(threshold, short_threshold)
+    self.bands = bands
+    self.rows = num_perm // bands
+    self._a = rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+    self._b = rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+    self._signatures = []
+    self._short = []
+    self._buckets = {}
+
+  def signature(self, text: str):
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode('utf-8')) & MERSENNE_PRIME for shingle in shingles(text)),
+        dtype=np.uint64
+    )
+    # Both factors are below 2^31, so the products fit in 64 bits
+    permuted = (np.outer(hashes, self._a) + self._b) % MERSENNE_PRIME
+    return permuted.min(axis=0)
+
+  def _band_keys(self, signature):
+    for band in range(self.bands):
+      rows = signature[band * self.rows:(band + 1) * self.rows]
+      yield band, rows.tobytes()
+
+  def add(self, question: dict):
+    """
+    Index the question and return True, or return False if it is a near
+    duplicate of a question already added.
+    """
+    signature = self.signature(question_text(question))
+    short = len(str(question.get('question', '')).strip()) < self.short_stem
+    keys = list(self._band_keys(signature))
+
+    candidates = set()
+    for key in keys:
+      candidates.update(self._buckets.get(key, ()))
+    for candidate in candidates:
+      threshold = self.short_threshold if short or self._short[candidate] else self.threshold
+      if np.mean(self._signatures[candidate] == signature) >= threshold:
+        return False
+
+    index = len(self._signatures)
+    self._signatures.append(signature)
+    self._short.append(short)
+    for key in keys:
+      self._buckets.setdefault(key, []).append(index)
+    return True
+
+  def filter(self, questions: list):
+    return [question for question in questions if self.add(question)]
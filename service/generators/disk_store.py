@@ -0,0 +1,118 @@
+import os
+import threading
+
+try:
+  import fcntl
+except ImportError:
+  # Not available on Windows, the disk usage is then counted per process
+  fcntl = None
+
+# Total size of the entries, shared by the processes using the directory
+USAGE_FILE = 'usage'
+
+
+class DiskStore:
+  """
+  Size bounded key value store of files, shared by every process using the
+  same directory.
+
+  Writes are atomic, so other processes never read a half written entry.
+  The total size of the entries is kept in USAGE_FILE under a file lock, so
+  the bound holds across processes and a new process does not rescan the
+  directory. The least recently used entries are evicted first (reads
+  refresh the mtime).
+  """
+
+  def __init__(self, directory: str, disk_bytes: int, suffix: str):
+    self.directory = directory
+    self.disk_bytes = disk_bytes
+    self.suffix = suffix
+    self._disk_usage = None
+    self._lock = threading.Lock()
+
+  def path(self, key: str):
+    return os.path.join(self.directory, key[:2], key + self.suffix)
+
+  def get(self, key: str):
+    path = self.path(key)
+    try:
+      with open(path, 'rb') as f:
+        data = f.read()
+      os.utime(path)
+      return data or None
+    except FileNotFoundError:
+      return None
+
+  def size(self, key: str):
+    try:
+      return os.path.getsize(self.path(key)) or None
+    except FileNotFoundError:
+      return None
+
+  def set(self, key: str, data: bytes):
+    path = self.path(key)
+    previous = self.size(key) or 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+      f.write(data)
+    os.replace(tmp_path, path)
+
+    usage = self._update_usage(
+        lambda usage: self._scan_usage() if usage is None else usage + len(data) - previous)
+    if usage > self.disk_bytes:
+      self._update_usage(lambda usage: self._evict())
+
+  def _update_usage(self, update):
+    """
+    Replace the disk usage with `update(usage)`, usage being None when it
+    is not known yet, and return it. Runs under a lock shared by processes.
+    """
+    if fcntl is None:
+      with self._lock:
+        self._disk_usage = update(self._disk_usage)
+        return self._disk_usage
+
+    os.makedirs(self.directory, exist_ok=True)
+    fd = os.open(os.path.join(self.directory, USAGE_FILE), os.O_RDWR | os.O_CREAT)
+    with os.fdopen(fd, 'r+') as f:
+      # Released when the file is closed
+      fcntl.flock(f, fcntl.LOCK_EX)
+      content = f.read().strip()
+      usage = update(int(content) if content else None)
+      f.seek(0)
+      f.truncate()
+      f.write(str(usage))
+      return usage
+
+  def _entries(self):
+    entries = []
+    for root, _, files in os.walk(self.directory):
+      for name in files:
+        if not name.endswith(self.suffix):
+          continue
+        path = os.path.join(root, name)
+        try:
+          stat = os.stat(path)
+        except FileNotFoundError:
+          continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+  def _scan_usage(self):
+    return sum(size for _, size, _ in self._entries())
+
+  def _evict(self):
+    entries = sorted(self._entries())
+    usage = sum(size for _, size, _ in entries)
+    # Evict down to 90% so we do not rescan the directory on every write
+    target = self.disk_bytes * 0.9
+    for _, size, path in entries:
+      if usage <= target:
+        break
+      try:
+        os.remove(path)
+        usage -= size
+      except FileNotFoundError:
+        pass
+    return usage
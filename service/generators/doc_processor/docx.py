@@ -1,6 +1,7 @@
 from service.generators.generators import DocumentProcessor, TextProcessor, ImageProcessor, FileProcessor
-from llama_index.readers.file import DocxReader
 from controllers.shared_resources import task_results
+from service.workers.pool import cpu_pool
+from service.workers import jobs
 
 
 class DOCXProcessor(DocumentProcessor):
@@ -21,13 +22,8 @@ class DOCXProcessor(DocumentProcessor):
   #     base64_images.append(base64_encoded)
 
   #   return base64_images
-  def docx_to_text(self, docx_path: str):
-    docx_reader = DocxReader()
-    docx_docs = docx_reader.load_data(docx_path)
-    text = ''
-    for doc in docx_docs:
-      text += doc.text + '\n'
-    return text
+  async def docx_to_text(self, docx_path: str):
+    return await cpu_pool.run(jobs.docx_to_text, docx_path)
 
   async def generate_questions_from_text(self, file_path: str, num_question: int, language: str, task_id: str = None, difficulty: str = "medium"):
     try:
@@ -37,7 +33,7 @@ class DOCXProcessor(DocumentProcessor):
             "progress": "Reading DOCX file"
         }
 
-      text = self.docx_to_text(file_path)
+      text = await self.docx_to_text(file_path)
 
       if task_id:
         task_results[task_id] = {
@@ -1,7 +1,5 @@
 from service.generators.generators import DocumentProcessor, ImageProcessor
-from PIL import Image
-import base64
-import io
+from service.generators.images import load_image
 import asyncio
 from controllers.shared_resources import task_results
 
@@ -10,27 +8,24 @@ class ImageGenerator(DocumentProcessor):
   def __init__(self, image_processor: ImageProcessor):
     self.image_processor = image_processor
 
-  def img_to_base64(self, img_path: str, task_id: str = None):
+  def load_image(self, img_path: str, task_id: str = None):
     try:
       if task_id:
         task_results[task_id] = {
             "status": "processing",
-            "progress": f"Converting image to base64"
+            "progress": "Loading image"
         }
 
-      # Open and convert image to base64
-      with Image.open(img_path) as img:
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        base64_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
+      # JPEG, PNG and WebP uploads are sent as is, others are re-encoded
+      image = load_image(img_path)
 
       if task_id:
         task_results[task_id] = {
             "status": "processing",
-            "progress": "Image converted successfully"
+            "progress": "Image loaded successfully"
         }
 
-      return base64_image
+      return image
 
     except Exception as e:
       if task_id:
@@ -45,11 +40,10 @@ class ImageGenerator(DocumentProcessor):
       if task_id:
         task_results[task_id] = {
             "status": "processing",
-            "progress": "Converting image to base64"
+            "progress": "Loading image"
         }
 
-      # Convert image to base64
-      base64_image = await asyncio.to_thread(self.img_to_base64, img_path, task_id)
+      image = await asyncio.to_thread(self.load_image, img_path, task_id)
 
       if task_id:
         task_results[task_id] = {
@@ -58,12 +52,12 @@ class ImageGenerator(DocumentProcessor):
         }
 
       # Generate questions using the image processor
-      questions = await self.image_processor.generate_questions([base64_image], num_question, language, difficulty)
+      questions = await self.image_processor.generate_questions([image], num_question, language, difficulty)
 
       if task_id:
         task_results[task_id] = {
-            "status": "completed",
-            "message": "Questions generated successfully"
+            "status": "processing",
+            "progress": "Questions generated, finalizing quiz"
         }
 
       return questions
@@ -1,12 +1,17 @@
 from service.generators.generators import DocumentProcessor, TextProcessor, ImageProcessor, FileProcessor
 from service.generators.base import FileUploader
+from service.generators.pages import PdfPageSource, classify_pdf, extract_text_pages
+from service.generators.planner import allocate
 import fitz
-from PIL import Image
-import base64
-import io
 import asyncio
+import os
 from controllers.shared_resources import task_results
 
+# "file" uploads the whole PDF, "hybrid" extracts the text of digital pages
+# and only sends scanned or figure heavy pages as images
+PDF_GENERATION_MODE = os.environ.get('PDF_GENERATION_MODE', 'file')
+MAX_PDF_PAGES = 300
+
 
 class PDFProcessor(DocumentProcessor):
   def __init__(self, text_processor: TextProcessor, image_processor: ImageProcessor, file_processor: FileProcessor, file_uploader: FileUploader):
@@ -16,51 +21,50 @@ class PDFProcessor(DocumentProcessor):
     self.file_uploader = file_uploader
 
   # https://python.langchain.com/docs/how_to/document_loader_pdf/#use-of-multimodal-models
-  def pdf_to_base64(self, pdf_path: str, task_id: str = None):
-    pages = []
-    with fitz.open(pdf_path) as pdf_document:
-      total_pages = pdf_document.page_count
-
-      for page_number in range(total_pages):
-        if task_id:
-          task_results[task_id] = {
-              "status": "processing",
-              "progress": f"Processing page {page_number + 1}/{total_pages}"
-          }
+  def uses_file_upload(self, pdf_path: str):
+    """
+    Whether generate_questions will upload the PDF to the File API, so the
+    upload can be prefetched. Blocking, it opens the PDF.
+    """
+    if PDF_GENERATION_MODE != 'file':
+      return False
+    try:
+      with fitz.open(pdf_path) as doc:
+        return len(doc) <= MAX_PDF_PAGES
+    except Exception:
+      return False
 
-        page = pdf_document.load_page(page_number)
-        pix = page.get_pixmap()
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+  def pdf_to_images(self, pdf_path: str, task_id: str = None, page_numbers: list = None):
+    def on_progress(rendered: int, total: int):
+      if task_id:
+        task_results[task_id] = {
+            "status": "processing",
+            "progress": f"Processing page {rendered}/{total}"
+        }
 
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        pages.append(base64.b64encode(buffer.getvalue()).decode("utf-8"))
-        # print(page_number, ':', len(pages[-1]))
+    return PdfPageSource(pdf_path, on_progress=on_progress, page_numbers=page_numbers)
 
-    return pages
+  async def pdf_to_text(self, pdf_path: str, task_id: str = None):
+    def on_progress(extracted: int, total: int):
+      if task_id:
+        task_results[task_id] = {
+            "status": "processing",
+            "progress": f"Processing page {extracted}/{total}"
+        }
 
-  def pdf_to_text(self, pdf_path: str, task_id: str = None):
-    text = ""
-    with fitz.open(pdf_path) as doc:
-      total_pages = len(doc)
-      for page_num in range(total_pages):
-        if task_id:
-          task_results[task_id] = {
-              "status": "processing",
-              "progress": f"Processing page {page_num + 1}/{total_pages}"
-          }
-        page = doc[page_num]
-        text += page.get_text()
-    return text
+    pages = await extract_text_pages(pdf_path, on_progress)
+    return "".join(text for _, _, text, _ in pages)
 
   async def generate_questions(self, pdf_path: str, num_question: int, language: str, task_id: str = None, difficulty: str = "medium"):
     with fitz.open(pdf_path) as doc:
       total_pages = len(doc)
-      if total_pages > 300:
+      if total_pages > MAX_PDF_PAGES:
         if task_id:
           task_results[task_id] = {
               "status": "failed", "progress": f"PDF with {total_pages} exceeds our limit"}
         return {}
+    if PDF_GENERATION_MODE == 'hybrid':
+      return await self.generate_questions_hybrid(pdf_path, num_question, language, task_id, difficulty)
     if task_id:
       task_results[task_id] = {"status": "processing",
                                "progress": f"Generating questions from {pdf_path}"}
@@ -68,15 +72,48 @@ class PDFProcessor(DocumentProcessor):
     return await self.file_processor.generate_questions(genai_link, num_question, language, difficulty)
 
   async def generate_questions_from_images(self, pdf_path: str, num_question: int, language: str, task_id: str = None, difficulty: str = "medium"):
-    base64_pages = await asyncio.to_thread(self.pdf_to_base64, pdf_path, task_id)
+    # Pages are rendered segment by segment while questions are generated
+    pages = self.pdf_to_images(pdf_path, task_id)
     if task_id:
       task_results[task_id] = {"status": "processing",
                                "progress": "Generating questions from images"}
-    return await self.image_processor.generate_questions(base64_pages, num_question, language, difficulty)
+    return await self.image_processor.generate_questions(pages, num_question, language, difficulty)
 
   async def generate_questions_from_text(self, pdf_path: str, num_question: int, language: str, task_id: str = None, difficulty: str = "medium"):
-    text = await asyncio.to_thread(self.pdf_to_text, pdf_path, task_id)
+    text = await self.pdf_to_text(pdf_path, task_id)
     if task_id:
       task_results[task_id] = {"status": "processing",
                                "progress": "Generating questions from text"}
     return await self.text_processor.generate_questions(text, num_question, language, difficulty)
+
+  async def generate_questions_hybrid(self, pdf_path: str, num_question: int, language: str, task_id: str = None, difficulty: str = "medium"):
+    def on_progress(extracted: int, total: int):
+      if task_id:
+        task_results[task_id] = {
+            "status": "processing",
+            "progress": f"Reading page {extracted}/{total}"
+        }
+
+    text_pages, image_pages = await classify_pdf(pdf_path, on_progress)
+    print(f'{pdf_path}: {len(text_pages)} text pages, {len(image_pages)} image pages')
+    if task_id:
+      task_results[task_id] = {"status": "processing",
+                               "progress": "Generating questions from text and images"}
+
+    # Questions are split by page count between the two parts
+    text_count, image_count = allocate(
+        [len(text_pages), len(image_pages)], num_question)
+    tasks = []
+    if text_pages and text_count > 0:
+      text = "".join(text for _, _, text in text_pages)
+      tasks.append(self.text_processor.generate_questions(
+          text, text_count, language, difficulty))
+    if image_pages and image_count > 0:
+      pages = self.pdf_to_images(pdf_path, task_id, page_numbers=image_pages)
+      tasks.append(self.image_processor.generate_questions(
+          pages, image_count, language, difficulty))
+
+    results = await asyncio.gather(*tasks)
+    questions = [question for result in results for question in result.get("questions", [])]
+    title = next((result["title"] for result in results if result.get("title")), None)
+    return {"questions": questions, "title": title}
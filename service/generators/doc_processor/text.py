@@ -48,8 +48,8 @@ class TextFileProcessor(DocumentProcessor):
 
       if task_id:
         task_results[task_id] = {
-            "status": "completed",
-            "message": "Questions generated successfully"
+            "status": "processing",
+            "progress": "Questions generated, finalizing quiz"
         }
 
       return questions
@@ -1,129 +1,256 @@
 import asyncio
+import json
+import random
 from service.generators.base import GenAIClient
-from service.generators.base import fix_json_array
+from service.generators.base import has_questions
+from service.generators.parsing import parse_questions, validate_question
+from service.generators.streaming import QuestionStreamParser, GEN_STREAMING
 from service.generators.summarizer import Summarizer
-from service.generators.constants import default_prompt, get_user_prompt_images, get_user_prompt_text, get_user_prompt_file
-import base64
+from service.generators.sink import current_question_sink
+from service.generators.dedup import QuestionDeduplicator
+from service.generators.constants import default_prompt, get_text_document, get_user_prompt_images, get_user_prompt_text, get_user_prompt_file, get_topup_instruction, question_response_schema
+from service.generators.deadline import Deadline, get_deadline, GEN_CALL_RETRIES, GEN_RETRY_BACKOFF_SECONDS, GEN_TOPUP_ROUNDS
+from service.workers.pool import cpu_pool
+from service.workers.jobs import split_documents, rank_chunks, count_tokens
+from service.generators.ranking import ranking_cache
+from service.generators.planner import ChunkPlanner, allocate
+from service.generators.pages import ImageListSource, batch_ranges, split_by_bytes
 
-from llama_index.core import Document
-from llama_index.core.node_parser import SentenceSplitter
+# TODO: Language mapping here
 
-import networkx as nx
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 
-# TODO: Language mapping here
+async def collect_questions(request, limit: int = None, deadline: Deadline = None, deduplicator: QuestionDeduplicator = None, label: str = 'call', titles: list = None):
+  """
+  Run one Gemini request and parse its questions, retrying only this request
+  with backoff when it fails or returns no valid question. Invalid
+  questions of a response are reported and skipped.
+
+  `request(stream_to)` returns a new awaitable of the response text for
+  every attempt. With GEN_STREAMING, questions are extracted from the
+  response stream as soon as their JSON object closes. Near duplicates of
+  questions the `deduplicator` already saw are dropped, at most `limit`
+  questions are kept, and they are handed to the job's question sink right
+  away instead of after the whole fan-out. The quiz title of the response
+  is appended to `titles`.
+  """
+  sink = current_question_sink.get()
+  questions = []
+  seen = set()
+
+  async def deliver(items):
+    accepted = []
+    for question in items:
+      if limit is not None and len(questions) + len(accepted) >= limit:
+        break
+      if question["question"] in seen:
+        continue
+      seen.add(question["question"])
+      if deduplicator is None or deduplicator.add(question):
+        accepted.append(question)
+    questions.extend(accepted)
+    if accepted and sink is not None:
+      await sink.add(accepted)
+
+  def stream_to():
+    parser = QuestionStreamParser()
+
+    async def on_text(text):
+      valid = []
+      for item in parser.feed(text):
+        try:
+          valid.append(validate_question(item))
+        except ValueError:
+          # Reported by the parse of the whole response
+          continue
+      if valid:
+        await deliver(valid)
+
+    return on_text
+
+  for attempt in range(GEN_CALL_RETRIES + 1):
+    try:
+      result = parse_questions(await request(stream_to if GEN_STREAMING else None))
+      if result.errors or result.salvaged:
+        print(f"Parsing {label}: {result.summary()}")
+      # Questions missed by the stream parser, already streamed ones are skipped
+      await deliver(result.questions)
+      if result.title and titles is not None:
+        titles.append(result.title)
+      if result.questions or questions:
+        break
+      error = ValueError('Response has no valid question')
+    except Exception as e:
+      if questions:
+        # The questions streamed before the failure are kept
+        print(f"Generation {label} failed after {len(questions)} questions: {e}")
+        break
+      error = e
+
+    delay = GEN_RETRY_BACKOFF_SECONDS * 2 ** attempt + random.uniform(0, 1)
+    if attempt == GEN_CALL_RETRIES or (deadline is not None and deadline.remaining() <= delay):
+      raise error
+    print(
+        f"Generation call failed with {type(error).__name__}, retrying in {delay:.1f}s (attempt {attempt + 1})")
+    await asyncio.sleep(delay)
+
+  return questions
+
+
+async def fill_quotas(units, request_for, deadline: Deadline):
+  """
+  Generate `count` questions from every (unit, count) pair, return the
+  questions and the quiz title of the first response that has one.
+
+  Every unit is asked once, then only the units that delivered less than
+  their quota are asked for the missing questions, `request_for(unit, count,
+  questions, stream_to)` getting the questions the unit already delivered.
+  The quota of a unit whose call failed all its retries moves to the other
+  units.
+  Questions duplicating an earlier one are not counted as delivered. Stops
+  after GEN_TOPUP_ROUNDS rounds or when the deadline passes, returning what
+  was delivered.
+  """
+  quotas = [count for _, count in units]
+  delivered = [[] for _ in units]
+  pending = {i: count for i, count in enumerate(quotas) if count > 0}
+  deduplicator = QuestionDeduplicator()
+  titles = []
+  rounds = 0
+  while pending and not deadline.expired:
+    tasks = {
+        i: asyncio.ensure_future(collect_questions(
+            lambda stream_to, i=i, count=count: request_for(
+                units[i][0], count, delivered[i], stream_to),
+            count,
+            deadline,
+            deduplicator,
+            f'call {i + 1}/{len(units)}',
+            titles
+        ))
+        for i, count in pending.items()
+    }
+    done, not_done = await asyncio.wait(tasks.values(), timeout=deadline.remaining())
+    for task in not_done:
+      task.cancel()
+    if not_done:
+      print(f"Generation budget exceeded, {len(not_done)} calls cancelled")
+
+    failed = set()
+    for i, task in tasks.items():
+      if task in done and task.exception() is None:
+        delivered[i].extend(task.result())
+      else:
+        if task in done:
+          print(f"Error in task: {task.exception()}")
+        failed.add(i)
+
+    rounds += 1
+    if rounds > GEN_TOPUP_ROUNDS:
+      break
+
+    live = [i for i in range(len(units)) if i not in failed]
+    missing = sum(quotas[i] - len(delivered[i]) for i in failed)
+    if live and missing > 0:
+      for i in failed:
+        quotas[i] = len(delivered[i])
+      extra = allocate([quotas[i] for i in live], missing)
+      for i, count in zip(live, extra):
+        quotas[i] += count
+
+    pending = {i: quotas[i] - len(delivered[i])
+               for i in range(len(units)) if len(delivered[i]) < quotas[i]}
+    if pending:
+      print(
+          f"Top-up round {rounds}: {sum(pending.values())} questions missing from {len(pending)} calls")
+
+  questions = [question for questions in delivered for question in questions]
+  return questions, titles[0] if titles else None
 
 
 class QuestionGenerator(GenAIClient):
+  def __init__(self, api_key: str, default_prompt: str = ''):
+    # Ask Gemini for JSON matching the question schema instead of free text
+    super().__init__(api_key, default_prompt, generation_config={
+        "response_mime_type": "application/json",
+        "response_schema": question_response_schema
+    }, stage='generate')
 
-  async def generate_from_base64_images(self, prompt: str, images):
-    contents = [prompt]
-    for image in images:
-      contents.append({
-          "mime_type": "image/jpeg",
-          "data": base64.b64decode(image)
-      })
-    resp = await self.model.generate_content_async(contents=contents)
-    return resp.text
+  async def generate_from_images(self, prompt: str, images: list, timeout: float = None, stream_to=None, difficulty: str = None):
+    # `images` are blobs of raw bytes, see service.generators.images
+    return await self.generate(prompt, timeout, validate=has_questions, stream_to=stream_to, document=list(images), difficulty=difficulty)
 
-  async def generate_from_text(self, content: str):
-    resp = await self.model.generate_content_async(contents=content)
-    return resp.text
+  async def generate_from_text(self, prompt: str, document: str = None, timeout: float = None, stream_to=None, difficulty: str = None):
+    return await self.generate(prompt, timeout, validate=has_questions, stream_to=stream_to, document=document, difficulty=difficulty)
 
-  async def generate_from_genai_link(self, prompt: str, link):
-    contents = [prompt, link]
-    resp = await self.model.generate_content_async(contents=contents)
-    return resp.text
+  async def generate_from_genai_link(self, prompt: str, link, timeout: float = None, stream_to=None, difficulty: str = None):
+    return await self.generate(prompt, timeout, validate=has_questions, stream_to=stream_to, document=link, difficulty=difficulty)
 
 
 # Generate questions with text
 class TextProcessor:
-  def __init__(self, generator: QuestionGenerator, chunk_size: int = 100000, chunk_overlap: int = 5000):
+  def __init__(self, generator: QuestionGenerator, chunk_size: int = 8000, chunk_overlap: int = 400, planner: ChunkPlanner = None):
     if chunk_size <= chunk_overlap:
       raise ValueError('chunk_size must be greater than chunk_overlap')
     self.generator = generator
     self.chunk_size = chunk_size
     self.chunk_overlap = chunk_overlap
+    self.planner = planner or ChunkPlanner()
 
-  def chunk_document(self, text: str):
-    doc = Document(text=text)
-    splitter = SentenceSplitter(
-        chunk_size=self.chunk_size,
-        chunk_overlap=self.chunk_overlap
-    )
-    chunks = splitter.get_nodes_from_documents([doc])
-    return chunks
-
-  async def generate_questions(self, text: str, num_question: int, language: str, difficulty: str = "medium"):
-    chunks = self.chunk_document(text)
-    all_questions = []
-    attempts = 0
-    max_attempts = 10
-    while len(all_questions) < num_question and attempts < max_attempts:
-      attempts += 1
-      remaining_question = num_question - len(all_questions)
-      if (len(chunks) <= remaining_question):
-        questions_json = []
-        num_question_in_chunk = remaining_question // len(chunks)
-        remain_question = remaining_question % len(chunks)
-        tasks = []
-        for chunk in chunks:
-          prompt = get_user_prompt_text(
-              language,
-              num_question_in_chunk + (1 if remain_question > 0 else 0),
-              chunk.text,
-              difficulty
-          )
-          remain_question -= 1
-          tasks.append(self.generator.generate_from_text(prompt))
-        questions_json = await asyncio.gather(*tasks, return_exceptions=True)
-        valid_results = []
-        for result in questions_json:
-          if isinstance(result, Exception):
-            print(f"Error in task: {result}")
-            valid_results.append('{"questions": []}')
-          else:
-            valid_results.append(result)
-        merged = fix_json_array(valid_results)
-        all_questions.extend(merged["questions"])
-      else:
-        # Summarized the main content
-        chunks_text = [node.text for node in chunks]
-        vectorizer = TfidfVectorizer(stop_words='english')
-        tfidf_matrix = vectorizer.fit_transform(chunks_text)
-        sim_matrix = cosine_similarity(tfidf_matrix)
-        graph = nx.from_numpy_array(sim_matrix)
-        scores = nx.pagerank(graph)
-        ranked_chunks = sorted(
-            ((score, chunk) for chunk, score in zip(chunks_text, scores.values())),
-            key=lambda x: x[0],
-            reverse=True
-        )
-        selected_chunks = [chunk for score,
-                           chunk in ranked_chunks[:remaining_question]]
-        print('Done ranking document')
-        tasks = []
-        for chunk in selected_chunks:
-          prompt = get_user_prompt_text(language, 1, chunk, difficulty)
-          tasks.append(self.generator.generate_from_text(prompt))
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        valid_jsons = []
-        for result in results:
-          if isinstance(result, Exception):
-            print(f"Error in task: {result}")
-            valid_jsons.append('{"questions": []}')
-          else:
-            valid_jsons.append(result)
-        merged = fix_json_array(valid_jsons)
-        all_questions.extend(merged["questions"])
-    merged = {"questions": all_questions[:num_question]}
+  async def chunk_document(self, text: str):
+    chunks = await cpu_pool.run(split_documents, [(text, {})], self.chunk_size, self.chunk_overlap)
+    return [chunk_text for chunk_text, _ in chunks]
+
+  async def rank_chunks(self, chunks):
+    key = ranking_cache.key(chunks)
+    ranking = ranking_cache.get(key)
+    if ranking is None:
+      ranking = await cpu_pool.run(rank_chunks, chunks)
+      ranking_cache.set(key, ranking)
+      print('Done ranking document')
+    return ranking
+
+  async def generate_questions(self, text: str, num_question: int, language: str, difficulty: str = "medium", deadline: Deadline = None):
+    deadline = deadline or get_deadline()
+    chunks = await self.chunk_document(text)
+    token_counts = await cpu_pool.run(count_tokens, chunks)
+    ranking = None
+    if self.planner.needs_ranking(token_counts, num_question):
+      # Only the most central chunks fit in the planned calls
+      ranking = await self.rank_chunks(chunks)
+    calls = self.planner.plan(token_counts, num_question, ranking)
+    print(f'Planned {len(calls)} calls for {num_question} questions')
+
+    def request_for(chunk_ids, count, asked, stream_to):
+      document = get_text_document('\n'.join(chunks[i] for i in chunk_ids))
+      # The rest of a bigger quota comes in top-ups listing `asked`
+      count = min(count, self.planner.max_questions_per_call)
+      prompt = get_user_prompt_text(
+          language, count, difficulty) + get_topup_instruction(asked)
+      return self.generator.generate_from_text(prompt, document, deadline.remaining(), stream_to, difficulty)
+
+    questions, title = await fill_quotas(
+        [(call.chunk_ids, call.count) for call in calls], request_for, deadline)
+    merged = {"questions": questions[:num_question], "title": title}
     return merged
 
 
 # Generate questions with images
+def merge_responses(responses: list):
+  """
+  Merge the responses of the requests of one split unit into one response
+  text, as collect_questions expects a single response per request.
+  """
+  questions = []
+  title = None
+  for response in responses:
+    result = parse_questions(response)
+    questions.extend(result.questions)
+    title = title or result.title
+  return json.dumps({"title": title, "questions": questions}, ensure_ascii=False)
+
+
 class ImageProcessor:
-  def __init__(self, generator: QuestionGenerator, summarizer: Summarizer, text_processor: TextProcessor, chunk_size: int = 500, chunk_overlap: int = 100):
+  def __init__(self, generator: QuestionGenerator, summarizer: Summarizer, text_processor: TextProcessor, chunk_size: int = 500, chunk_overlap: int = 20):
     if chunk_size <= chunk_overlap:
       raise ValueError('chunk_size must be greater than chunk_overlap')
     self.generator = generator
@@ -132,64 +259,64 @@ class ImageProcessor:
     self.chunk_overlap = chunk_overlap
     self.text_processor = text_processor
 
-  def generate_chunks(self, images):
-    chunks = []
-
-    i = 0
-    while i < len(images):
-      chunk = images[i:min(len(images), i+self.chunk_size)]
-      chunks.append(chunk)
-      i += self.chunk_size - self.chunk_overlap
-
-    return chunks
-
-  async def generate_questions(self, images, num_question: int, language: str, difficulty: str = "medium"):
-    image_segments = self.generate_chunks(images)
-    all_questions = []
-    attempts = 0
-    max_attempts = 10
-    while len(all_questions) < num_question and attempts < max_attempts:
-      attempts += 1
-      remaining_question = num_question - len(all_questions)
-      if len(image_segments) <= remaining_question:
-        tasks = []
-        num_question_in_chunk = remaining_question // len(image_segments)
-        remain_question = remaining_question % len(image_segments)
-        for images in image_segments:
-          prompt = get_user_prompt_images(
-              language,
-              num_question_in_chunk + (1 if remain_question > 0 else 0),
-              difficulty
-          )
-          remain_question -= 1
-          tasks.append(
-              self.generator.generate_from_base64_images(prompt, images))
-        questions_json = await asyncio.gather(*tasks, return_exceptions=True)
-        valid_results = []
-        for result in questions_json:
-          if isinstance(result, Exception):
-            print(f"Error in task: {result}")
-            valid_results.append('{"questions": []}')
-          else:
-            valid_results.append(result)
-        merged = fix_json_array(valid_results)
-        all_questions.extend(merged["questions"])
-      else:
-        print('Summarizing the images...')
-        summarize_tasks = []
-        for images in image_segments:
-          summarize_tasks.append(self.summarizer.summarize_images(images))
-        summaries = await asyncio.gather(*summarize_tasks, return_exceptions=True)
-        text = ''
-        for summary in summaries:
-          if isinstance(summary, Exception):
-            print(f"Error in summarization: {summary}")
-            continue
-          text += summary + '\n'
-        print('Summarized text:', text)
-        merged = await self.text_processor.generate_questions(text, remaining_question, language, difficulty)
-        all_questions.extend(merged["questions"])
-    merged = {"questions": all_questions[:num_question]}
+  async def summarize_segment(self, source, start: int, end: int):
+    async with source.pages(start, end) as images:
+      # Split when the estimated size of the segment was too low
+      summaries = await asyncio.gather(*[
+          self.summarizer.summarize_images(part) for part in split_by_bytes(images)
+      ])
+      return '\n'.join(summaries)
+
+  async def generate_questions(self, images, num_question: int, language: str, difficulty: str = "medium", deadline: Deadline = None):
+    """
+    `images` is a list of image blobs or a page source from
+    service.generators.pages, whose segments are only loaded while their
+    requests run.
+    """
+    deadline = deadline or get_deadline()
+    source = images if hasattr(images, 'pages') else ImageListSource(images)
+    skipped = await source.skip_redundant()
+    if skipped:
+      print(f'Skipped {len(skipped)} blank or duplicate pages: {skipped}')
+    # Segments are packed by bytes and image tokens, chunk_size is a cap
+    segments = batch_ranges(await source.page_costs(), self.chunk_size, self.chunk_overlap)
+    if len(segments) > num_question:
+      print('Summarizing the images...')
+      summarize_tasks = []
+      for start, end in segments:
+        summarize_tasks.append(self.summarize_segment(source, start, end))
+      summaries = await asyncio.gather(*summarize_tasks, return_exceptions=True)
+      text = ''
+      for summary in summaries:
+        if isinstance(summary, Exception):
+          print(f"Error in summarization: {summary}")
+          continue
+        text += summary + '\n'
+      print('Summarized text:', text)
+      return await self.text_processor.generate_questions(text, num_question, language, difficulty, deadline)
+
+    def prompt_for(count, asked):
+      return get_user_prompt_images(language, count, difficulty) + get_topup_instruction(asked)
+
+    async def request_for(segment, count, asked, stream_to):
+      # Top-ups load the segment again rather than keeping it in memory
+      async with source.pages(*segment) as images:
+        parts = split_by_bytes(images)
+        if len(parts) == 1:
+          return await self.generator.generate_from_images(prompt_for(count, asked), images, deadline.remaining(), stream_to, difficulty)
+
+        # The estimated size of the segment was too low, send it in parts
+        counts = allocate([len(part) for part in parts], count)
+        responses = await asyncio.gather(*[
+            self.generator.generate_from_images(prompt_for(part_count, asked), part, deadline.remaining(), stream_to, difficulty)
+            for part, part_count in zip(parts, counts) if part_count > 0
+        ])
+        return merge_responses(responses)
+
+    quotas = allocate([end - start for start, end in segments], num_question)
+    questions, title = await fill_quotas(
+        list(zip(segments, quotas)), request_for, deadline)
+    merged = {"questions": questions[:num_question], "title": title}
     return merged
 
 
@@ -198,19 +325,17 @@ class FileProcessor:
   def __init__(self, generator: QuestionGenerator):
     self.generator = generator
 
-  async def generate_questions(self, genai_link, num_question: int, language: str, difficulty: str = "medium"):
-    all_questions = []
-    attempts = 0
-    max_attempts = 10
-    while len(all_questions) < num_question and attempts < max_attempts:
-      attempts += 1
-      remaining_question = num_question - len(all_questions)
+  async def generate_questions(self, genai_link, num_question: int, language: str, difficulty: str = "medium", deadline: Deadline = None):
+    deadline = deadline or get_deadline()
+
+    def request_for(link, count, asked, stream_to):
       prompt = get_user_prompt_file(
-          lang=language, count=remaining_question, difficulty=difficulty)
-      result = await self.generator.generate_from_genai_link(prompt, genai_link)
-      merged = fix_json_array([result])
-      all_questions.extend(merged["questions"])
-    merged = {"questions": all_questions[:num_question]}
+          lang=language, count=count, difficulty=difficulty) + get_topup_instruction(asked)
+      return self.generator.generate_from_genai_link(prompt, link, deadline.remaining(), stream_to, difficulty)
+
+    questions, title = await fill_quotas(
+        [(genai_link, num_question)], request_for, deadline)
+    merged = {"questions": questions[:num_question], "title": title}
     return merged
 
 
@@ -0,0 +1,123 @@
+"""
+Image encoding shared by the generation and ingestion paths.
+
+Images travel as Gemini blobs, {"mime_type": ..., "data": raw bytes}, from
+rendering to the request, without base64 round trips.
+"""
+
+import io
+import math
+import os
+
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'jpeg').lower()
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '85'))
+PDF_RENDER_DPI = int(os.environ.get('PDF_RENDER_DPI', '72'))
+
+MIME_TYPES = {
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'png': 'image/png',
+}
+
+# Rough compressed size of a rendered pixel, used to size pages that are
+# not rendered yet when the page cache is disabled
+BYTES_PER_PIXEL = {
+    'jpeg': 0.5,
+    'webp': 0.4,
+    'png': 2.0,
+}
+
+# Gemini counts an image up to 384px on both sides as one tile, and crops
+# bigger ones into 768px tiles
+IMAGE_TILE_TOKENS = 258
+
+# Uploads already in a format Gemini reads are sent untouched
+PASSTHROUGH_MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+}
+
+
+class ImageEncoder:
+  def __init__(self, image_format: str = IMAGE_FORMAT, quality: int = IMAGE_QUALITY, dpi: int = PDF_RENDER_DPI):
+    if image_format not in MIME_TYPES:
+      raise ValueError(f'Unsupported image format: {image_format}')
+    self.image_format = image_format
+    self.quality = quality
+    self.dpi = dpi
+
+  @property
+  def mime_type(self):
+    return MIME_TYPES[self.image_format]
+
+  @property
+  def settings(self):
+    # Picklable, so worker jobs can rebuild the encoder
+    return (self.image_format, self.quality, self.dpi)
+
+  def blob(self, data: bytes):
+    return {"mime_type": self.mime_type, "data": data}
+
+  def encode_pixmap(self, pix):
+    if self.image_format == 'png':
+      return pix.tobytes('png')
+    if self.image_format == 'jpeg':
+      return pix.tobytes('jpeg', jpg_quality=self.quality)
+
+    from PIL import Image
+
+    # Reads the pixmap samples in place instead of copying them
+    img = Image.frombuffer('RGB', (pix.width, pix.height),
+                           pix.samples_mv, 'raw', 'RGB', pix.stride, 1)
+    return self.encode_image(img)
+
+  def encode_image(self, img):
+    buffer = io.BytesIO()
+    if self.image_format == 'png':
+      img.save(buffer, format='PNG')
+    else:
+      img.convert('RGB').save(
+          buffer, format=self.image_format.upper(), quality=self.quality)
+    return buffer.getvalue()
+
+  def render_page(self, page):
+    return self.encode_pixmap(page.get_pixmap(dpi=self.dpi))
+
+  def page_dimensions(self, page):
+    zoom = self.dpi / 72
+    return round(page.rect.width * zoom), round(page.rect.height * zoom)
+
+  def estimate_bytes(self, width: int, height: int):
+    return int(width * height * BYTES_PER_PIXEL[self.image_format])
+
+
+def image_tokens(width: int, height: int):
+  if width <= 384 and height <= 384:
+    return IMAGE_TILE_TOKENS
+  return math.ceil(width / 768) * math.ceil(height / 768) * IMAGE_TILE_TOKENS
+
+
+def blob_dimensions(blob: dict):
+  from PIL import Image
+
+  try:
+    # Only reads the header
+    with Image.open(io.BytesIO(blob['data'])) as img:
+      return img.size
+  except Exception:
+    return None
+
+
+def load_image(img_path: str, encoder: ImageEncoder = None):
+  mime_type = PASSTHROUGH_MIME_TYPES.get(os.path.splitext(img_path)[1].lower())
+  if mime_type is not None:
+    with open(img_path, 'rb') as f:
+      return {"mime_type": mime_type, "data": f.read()}
+
+  from PIL import Image
+
+  encoder = encoder or ImageEncoder()
+  with Image.open(img_path) as img:
+    return encoder.blob(encoder.encode_image(img))
@@ -0,0 +1,194 @@
+import asyncio
+import os
+import random
+import re
+import time
+
+GEMINI_REQUESTS_PER_MINUTE = int(
+    os.environ.get('GEMINI_REQUESTS_PER_MINUTE', '60'))
+GEMINI_TOKENS_PER_MINUTE = int(
+    os.environ.get('GEMINI_TOKENS_PER_MINUTE', '1000000'))
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', '8'))
+GEMINI_TIMEOUT_SECONDS = float(
+    os.environ.get('GEMINI_TIMEOUT_SECONDS', '300'))
+GEMINI_MAX_RETRIES = int(os.environ.get('GEMINI_MAX_RETRIES', '4'))
+
+# Rough Gemini token costs used to budget a request before sending it
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258
+FILE_TOKENS = 32000
+
+RETRY_IN_PATTERN = re.compile(r'retry in ([\d.]+)\s*s', re.IGNORECASE)
+RETRY_DELAY_PATTERN = re.compile(
+    r'retry_delay\s*{\s*seconds:\s*(\d+)', re.IGNORECASE)
+
+
+def estimate_tokens(contents):
+  if isinstance(contents, str):
+    return max(1, len(contents) // CHARS_PER_TOKEN)
+  if isinstance(contents, (bytes, bytearray)):
+    return IMAGE_TOKENS
+  if isinstance(contents, dict):
+    if 'data' in contents:
+      return IMAGE_TOKENS
+    return estimate_tokens(contents.get('text', ''))
+  if isinstance(contents, (list, tuple)):
+    return sum(estimate_tokens(part) for part in contents)
+  # Uploaded File API references
+  return FILE_TOKENS
+
+
+def _status_code(error: Exception):
+  code = getattr(error, 'code', None)
+  if isinstance(code, int):
+    return code
+  return None
+
+
+def is_rate_limit_error(error: Exception):
+  return _status_code(error) == 429 or type(error).__name__ == 'ResourceExhausted'
+
+
+def is_transient_error(error: Exception):
+  if isinstance(error, asyncio.TimeoutError):
+    return True
+  if _status_code(error) in (500, 502, 503, 504):
+    return True
+  return type(error).__name__ in ('ServiceUnavailable', 'InternalServerError', 'DeadlineExceeded')
+
+
+def retry_after(error: Exception):
+  message = str(error)
+  for pattern in (RETRY_IN_PATTERN, RETRY_DELAY_PATTERN):
+    match = pattern.search(message)
+    if match:
+      return float(match.group(1))
+  return None
+
+
+class TokenBucket:
+  def __init__(self, per_minute: int):
+    self.per_minute = per_minute
+    self.rate = per_minute / 60
+    self.tokens = float(per_minute)
+    self.updated_at = time.monotonic()
+
+  def _refill(self):
+    now = time.monotonic()
+    self.tokens = min(self.per_minute, self.tokens +
+                      (now - self.updated_at) * self.rate)
+    self.updated_at = now
+
+  def set_rate(self, rate: float):
+    self._refill()
+    self.rate = rate
+
+  def wait_time(self, amount: float):
+    self._refill()
+    # A request bigger than the whole bucket only waits for a full bucket
+    amount = min(amount, self.per_minute)
+    if self.tokens >= amount:
+      return 0
+    return (amount - self.tokens) / self.rate
+
+  def take(self, amount: float):
+    self._refill()
+    self.tokens -= amount
+
+
+class AdaptiveRateLimiter:
+  """
+  Client side limiter shared by every Gemini call.
+
+  Requests and input tokens per minute are budgeted with two token buckets.
+  Their refill rate adapts AIMD style: a 429 halves it, every success adds
+  back a little, so bursts settle just below the real quota instead of
+  failing into empty results. Rate limited and transient failures are
+  retried with exponential backoff, honoring the retry delay Gemini sends.
+  """
+
+  MIN_FACTOR = 0.05
+  INCREASE_STEP = 0.05
+
+  def __init__(self, requests_per_minute: int, tokens_per_minute: int, max_concurrency: int, timeout: float, max_retries: int):
+    self.requests = TokenBucket(requests_per_minute)
+    self.tokens = TokenBucket(tokens_per_minute)
+    self.timeout = timeout
+    self.max_retries = max_retries
+    self.factor = 1.0
+    self._semaphore = asyncio.Semaphore(max_concurrency)
+    self._lock = asyncio.Lock()
+    self._resume_at = 0
+
+  def _set_factor(self, factor: float):
+    self.factor = min(1.0, max(self.MIN_FACTOR, factor))
+    self.requests.set_rate(self.requests.per_minute / 60 * self.factor)
+    self.tokens.set_rate(self.tokens.per_minute / 60 * self.factor)
+
+  async def _acquire(self, estimated_tokens: int):
+    # The lock keeps waiters in FIFO order while they wait for budget
+    async with self._lock:
+      while True:
+        wait = max(
+            self._resume_at - time.monotonic(),
+            self.requests.wait_time(1),
+            self.tokens.wait_time(estimated_tokens)
+        )
+        if wait <= 0:
+          break
+        await asyncio.sleep(wait)
+      self.requests.take(1)
+      self.tokens.take(estimated_tokens)
+
+  def _on_success(self, response, estimated_tokens: int):
+    usage = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(usage, 'prompt_token_count', None)
+    if isinstance(prompt_tokens, int):
+      self.tokens.take(prompt_tokens - estimated_tokens)
+    if self.factor < 1.0:
+      self._set_factor(self.factor + self.INCREASE_STEP)
+
+  def _on_rate_limit(self, delay: float):
+    self._set_factor(self.factor / 2)
+    self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+  async def call(self, request, estimated_tokens: int = 1, timeout: float = None, max_retries: int = None):
+    """
+    Run `request`, a function returning a new awaitable for every attempt.
+    """
+    timeout = timeout or self.timeout
+    if max_retries is None:
+      max_retries = self.max_retries
+    for attempt in range(max_retries + 1):
+      await self._acquire(estimated_tokens)
+      try:
+        async with self._semaphore:
+          response = await asyncio.wait_for(request(), timeout)
+        self._on_success(response, estimated_tokens)
+        return response
+      except Exception as e:
+        if attempt == max_retries:
+          raise
+
+        backoff = min(60, 2 ** attempt) + random.uniform(0, 1)
+        if is_rate_limit_error(e):
+          delay = retry_after(e) or backoff
+          self._on_rate_limit(delay)
+          print(
+              f"Gemini rate limited, retrying in {delay:.1f}s (attempt {attempt + 1})")
+        elif is_transient_error(e):
+          delay = backoff
+          print(
+              f"Gemini call failed with {type(e).__name__}, retrying in {delay:.1f}s (attempt {attempt + 1})")
+        else:
+          raise
+      await asyncio.sleep(delay)
+
+
+gemini_limiter = AdaptiveRateLimiter(
+    GEMINI_REQUESTS_PER_MINUTE,
+    GEMINI_TOKENS_PER_MINUTE,
+    GEMINI_MAX_CONCURRENCY,
+    GEMINI_TIMEOUT_SECONDS,
+    GEMINI_MAX_RETRIES
+)
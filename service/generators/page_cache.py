@@ -0,0 +1,41 @@
+import hashlib
+import os
+
+from service.generators.disk_store import DiskStore
+
+PAGE_CACHE_ENABLED = os.environ.get(
+    'PAGE_CACHE_ENABLED', 'true').lower() == 'true'
+PAGE_CACHE_DIR = os.environ.get(
+    'PAGE_CACHE_DIR', os.path.join('.cache', 'pages'))
+PAGE_CACHE_DISK_MB = int(os.environ.get('PAGE_CACHE_DISK_MB', '2048'))
+
+
+def page_key(file_sha256: str, page_number: int, encoder_settings: tuple):
+  digest = hashlib.sha256()
+  digest.update(f'{file_sha256}:{page_number}:{encoder_settings!r}'.encode('utf-8'))
+  return digest.hexdigest()
+
+
+class PageCache(DiskStore):
+  """
+  Content addressed cache of rendered PDF pages, keyed by `page_key`. Every
+  page is a file holding the encoded image, shared by the worker processes
+  that render pages.
+  """
+
+  def __init__(self, directory: str, disk_bytes: int, enabled: bool = True):
+    super().__init__(directory, disk_bytes, '.page')
+    self.enabled = enabled
+
+  def set(self, key: str, data: bytes):
+    if os.path.exists(self.path(key)):
+      # Rendered by another worker meanwhile
+      return
+    super().set(key, data)
+
+
+page_cache = PageCache(
+    PAGE_CACHE_DIR,
+    PAGE_CACHE_DISK_MB * 1024 * 1024,
+    PAGE_CACHE_ENABLED
+)
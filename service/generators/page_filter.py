@@ -0,0 +1,119 @@
+"""
+Blank and near-duplicate page detection run before page images are batched.
+
+Every page gets a signature from a small grayscale render: horizontal and
+vertical difference hashes of HASH_SIZE x HASH_SIZE bits each, and the share
+of its pixels that differ from the background ("ink").
+"""
+
+import os
+
+import numpy as np
+
+PAGE_SKIP_ENABLED = os.environ.get(
+    'PAGE_SKIP_ENABLED', 'true').lower() == 'true'
+# Pages with less ink than this share of their pixels are blank
+PAGE_BLANK_INK_RATIO = float(os.environ.get('PAGE_BLANK_INK_RATIO', '0.002'))
+# Pages whose hashes differ by at most this share of bits are duplicates
+PAGE_DUPLICATE_DISTANCE = float(
+    os.environ.get('PAGE_DUPLICATE_DISTANCE', '0.04'))
+
+# 2 x 256 bits. 64 are too coarse to tell slides of the same template apart,
+# and horizontal gradients alone miss layouts that only differ vertically
+HASH_SIZE = 16
+# Longest side of the grayscale render the signature is computed on
+SIGNATURE_PIXELS = 128
+# Gray levels away from the background that count as ink
+INK_THRESHOLD = 48
+
+
+def _shrink(gray, width: int, height: int):
+  # Area average over a grid, the render is always bigger than the grid
+  ys = np.linspace(0, gray.shape[0], height + 1).astype(int)[:-1]
+  xs = np.linspace(0, gray.shape[1], width + 1).astype(int)[:-1]
+  sums = np.add.reduceat(np.add.reduceat(gray, ys, axis=0), xs, axis=1)
+  counts = np.outer(np.diff(np.append(ys, gray.shape[0])),
+                    np.diff(np.append(xs, gray.shape[1])))
+  return sums / counts
+
+
+def gray_signature(gray):
+  """
+  (hash bytes, ink ratio) of a 2D uint8 grayscale array.
+  """
+  gray = np.asarray(gray, dtype=np.float32)
+  background = np.median(gray)
+  ink = float(np.mean(np.abs(gray - background) > INK_THRESHOLD))
+  small = _shrink(gray, HASH_SIZE + 1, HASH_SIZE + 1)
+  horizontal = small[:-1, 1:] > small[:-1, :-1]
+  vertical = small[1:, :-1] > small[:-1, :-1]
+  return np.packbits(np.concatenate([horizontal.ravel(), vertical.ravel()])).tobytes(), ink
+
+
+def pixmap_signature(page):
+  import fitz
+
+  zoom = SIGNATURE_PIXELS / max(page.rect.width, page.rect.height, 1)
+  pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+  gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(
+      pix.height, pix.stride)[:, :pix.width]
+  if gray.shape[0] <= HASH_SIZE or gray.shape[1] <= HASH_SIZE:
+    return None
+  return gray_signature(gray)
+
+
+def image_signature(data: bytes):
+  import io
+  from PIL import Image
+
+  with Image.open(io.BytesIO(data)) as img:
+    img.draft('L', (SIGNATURE_PIXELS, SIGNATURE_PIXELS))
+    gray = img.convert('L')
+    gray.thumbnail((SIGNATURE_PIXELS, SIGNATURE_PIXELS))
+    if gray.width <= HASH_SIZE or gray.height <= HASH_SIZE:
+      return None
+    return gray_signature(np.asarray(gray))
+
+
+def redundant_pages(signatures: list, blank_ratio: float = PAGE_BLANK_INK_RATIO, max_distance: float = PAGE_DUPLICATE_DISTANCE):
+  """
+  Map the index of every page to skip to "blank" or to the index of the
+  page kept in its place. Of near-duplicates, the page with the most ink is
+  kept, so the last step of a slide build wins over the first ones. Pages
+  are compared with the hash of the first page of each group, not with the
+  kept one, so a chain of small differences does not merge distant pages.
+  Pages without a signature are always kept, and so is at least one page.
+  """
+  skipped = {}
+  kept = []
+  kept_hashes = []
+  for i, signature in enumerate(signatures):
+    if signature is None:
+      continue
+    page_hash, ink = signature
+    if ink < blank_ratio:
+      skipped[i] = 'blank'
+      continue
+
+    bits = np.unpackbits(np.frombuffer(page_hash, dtype=np.uint8))
+    if kept_hashes:
+      distances = np.mean(np.array(kept_hashes) != bits, axis=1)
+      closest = int(np.argmin(distances))
+      if distances[closest] <= max_distance:
+        other = kept[closest]
+        if ink > signatures[other][1]:
+          kept[closest] = i
+          skipped[other] = i
+          # Pages collapsed into the replaced one now point to this page
+          for page, reason in skipped.items():
+            if reason == other:
+              skipped[page] = i
+        else:
+          skipped[i] = other
+        continue
+    kept.append(i)
+    kept_hashes.append(bits)
+
+  if len(skipped) == len(signatures) and signatures:
+    skipped.pop(min(skipped))
+  return skipped
@@ -0,0 +1,300 @@
+"""
+Page sources of the image generation and ingestion paths.
+
+A source knows its page count up front and hands out page images by range,
+so a PDF is only rendered segment by segment while its segments are sent.
+"""
+
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+from service.generators.base import file_sha256
+from service.generators.images import ImageEncoder, image_tokens, blob_dimensions
+from service.generators.limiter import IMAGE_TOKENS
+from service.generators.page_cache import page_cache
+from service.generators.page_filter import redundant_pages, PAGE_SKIP_ENABLED
+from service.generators.planner import GEN_CONTEXT_TOKENS
+from service.workers.pool import cpu_pool
+from service.workers.jobs import render_pdf_pages, measure_pdf_pages, pdf_page_count, image_signatures, extract_pdf_text
+
+# Pages rendered by one worker job, small enough to report steady progress
+RENDER_BATCH_PAGES = 8
+# Rendered pages held in memory at once, a bigger segment is let through alone
+PAGE_BUFFER_PAGES = int(os.environ.get('PAGE_BUFFER_PAGES', '100'))
+# Text extraction: pages of one worker job at least, and seconds between
+# two progress updates
+TEXT_BATCH_PAGES = 16
+PROGRESS_INTERVAL_SECONDS = 0.5
+
+# Gemini rejects requests with inline data over 20 MB, keep some headroom
+# for the prompt and the encoding of the request
+GEN_REQUEST_MAX_MB = float(os.environ.get('GEN_REQUEST_MAX_MB', '18'))
+# Image tokens of one request, defaults to the document budget of text calls
+GEN_REQUEST_IMAGE_TOKENS = int(
+    os.environ.get('GEN_REQUEST_IMAGE_TOKENS', str(GEN_CONTEXT_TOKENS)))
+
+# Hybrid mode: pages with less text than this, per letter sized page, or
+# with a bigger share of their area covered by pictures are sent as images
+PDF_MIN_TEXT_CHARS = int(os.environ.get('PDF_MIN_TEXT_CHARS', '200'))
+PDF_MAX_IMAGE_COVERAGE = float(
+    os.environ.get('PDF_MAX_IMAGE_COVERAGE', '0.35'))
+
+
+def request_max_bytes():
+  return int(GEN_REQUEST_MAX_MB * 1024 * 1024)
+
+
+def split_by_bytes(images: list, max_bytes: int = None):
+  """
+  Split rendered images into consecutive parts of at most `max_bytes`, for
+  ranges whose sizes were estimated too low. A single image over the limit
+  is a part of its own.
+  """
+  max_bytes = max_bytes or request_max_bytes()
+  parts = [[]]
+  size = 0
+  for image in images:
+    image_bytes = len(image['data'])
+    if parts[-1] and size + image_bytes > max_bytes:
+      parts.append([])
+      size = 0
+    parts[-1].append(image)
+    size += image_bytes
+  return parts
+
+
+def batch_ranges(costs: list, max_pages: int, overlap: int, max_bytes: int = None, max_tokens: int = None):
+  """
+  Pack pages into request ranges [start, end) by their (bytes, tokens)
+  cost. A range is filled up to `max_pages` pages, `max_bytes` and
+  `max_tokens`, only a page over the limits on its own is sent alone. The
+  next range starts `overlap` pages of context before the end of the last.
+  """
+  max_bytes = max_bytes or request_max_bytes()
+  max_tokens = max_tokens or GEN_REQUEST_IMAGE_TOKENS
+  ranges = []
+  start = 0
+  total = len(costs)
+  while start < total:
+    end = start
+    size = 0
+    tokens = 0
+    while end < total and end - start < max_pages:
+      page_bytes, page_tokens = costs[end]
+      if end > start and (size + page_bytes > max_bytes or tokens + page_tokens > max_tokens):
+        break
+      size += page_bytes
+      tokens += page_tokens
+      end += 1
+    ranges.append((start, end))
+    if end >= total:
+      break
+    # Small ranges overlap by half at most, so every call covers new pages
+    start = max(start + 1, end - min(overlap, (end - start) // 2))
+  return ranges
+
+
+class PageBudget:
+  """
+  Counting semaphore over pages instead of segments.
+  """
+
+  def __init__(self, pages: int):
+    self.pages = pages
+    self.used = 0
+    self._condition = asyncio.Condition()
+
+  @asynccontextmanager
+  async def hold(self, pages: int):
+    async with self._condition:
+      await self._condition.wait_for(
+          lambda: self.used == 0 or self.used + pages <= self.pages)
+      self.used += pages
+    try:
+      yield
+    finally:
+      async with self._condition:
+        self.used -= pages
+        self._condition.notify_all()
+
+
+class ImageListSource:
+  def __init__(self, images: list):
+    self.images = images
+    # Index of every skipped image, to "blank" or the index kept instead
+    self.skipped = {}
+
+  async def page_count(self):
+    return len(self.images)
+
+  async def skip_redundant(self):
+    if not PAGE_SKIP_ENABLED or not self.images:
+      return self.skipped
+    signatures = await cpu_pool.run(
+        image_signatures, [image['data'] for image in self.images])
+    self.skipped = redundant_pages(signatures)
+    self.images = [image for i, image in enumerate(self.images) if i not in self.skipped]
+    return self.skipped
+
+  async def page_costs(self):
+    costs = []
+    for image in self.images:
+      dimensions = blob_dimensions(image)
+      costs.append((len(image['data']),
+                    image_tokens(*dimensions) if dimensions else IMAGE_TOKENS))
+    return costs
+
+  @asynccontextmanager
+  async def pages(self, start: int, end: int):
+    yield self.images[start:end]
+
+
+class PdfPageSource:
+  """
+  Renders the pages of a PDF in the worker pool when a range is opened and
+  drops them when it is closed. At most PAGE_BUFFER_PAGES rendered pages are
+  held at once, so the peak memory is bounded by the segment size and a
+  segment renders while the others are being sent.
+  """
+
+  def __init__(self, pdf_path: str, encoder: ImageEncoder = None, on_progress=None, buffer_pages: int = PAGE_BUFFER_PAGES, page_numbers: list = None):
+    self.pdf_path = pdf_path
+    self.encoder = encoder or ImageEncoder()
+    # Only these pages of the document, in this order, when given
+    self.page_numbers = page_numbers
+    # Called with (rendered, total) after every rendered batch
+    self.on_progress = on_progress
+    self._budget = PageBudget(buffer_pages)
+    self._page_count = None
+    self._file_sha256 = None
+    self._measures = None
+    self._rendered = 0
+    # Page number of every skipped page, to "blank" or the page kept instead
+    self.skipped = {}
+
+  async def page_count(self):
+    if self.page_numbers is not None:
+      return len(self.page_numbers)
+    if self._page_count is None:
+      self._page_count = await cpu_pool.run(pdf_page_count, self.pdf_path)
+    return self._page_count
+
+  async def file_sha256(self):
+    # Key of the PDF in the page cache, so a re-uploaded file hits as well
+    if self._file_sha256 is None and page_cache.enabled:
+      self._file_sha256 = await asyncio.to_thread(file_sha256, self.pdf_path)
+    return self._file_sha256
+
+  async def selected_pages(self, start: int, end: int):
+    if self.page_numbers is not None:
+      return self.page_numbers[start:end]
+    return list(range(start, min(end, await self.page_count())))
+
+  async def measure(self):
+    """
+    (bytes, width, height, signature) by page number. Sizes are mostly
+    estimated, pages are only rendered when their range is opened.
+    """
+    if self._measures is None:
+      page_numbers = await self.selected_pages(0, await self.page_count())
+      sha256 = await self.file_sha256()
+      batches = await asyncio.gather(*[
+          cpu_pool.run(measure_pdf_pages, self.pdf_path,
+                       page_numbers[i:i + RENDER_BATCH_PAGES], self.encoder.settings, sha256, PAGE_SKIP_ENABLED)
+          for i in range(0, len(page_numbers), RENDER_BATCH_PAGES)
+      ])
+      self._measures = dict(
+          zip(page_numbers, [page for batch in batches for page in batch]))
+    return self._measures
+
+  async def skip_redundant(self):
+    if not PAGE_SKIP_ENABLED:
+      return self.skipped
+    measures = await self.measure()
+    page_numbers = await self.selected_pages(0, await self.page_count())
+    skipped = redundant_pages([measures[n][3] for n in page_numbers])
+    self.skipped = {
+        page_numbers[i]: reason if reason == 'blank' else page_numbers[reason]
+        for i, reason in skipped.items()
+    }
+    self.page_numbers = [n for i, n in enumerate(page_numbers) if i not in skipped]
+    return self.skipped
+
+  async def page_costs(self):
+    """
+    (bytes, image tokens) of every page.
+    """
+    measures = await self.measure()
+    page_numbers = await self.selected_pages(0, await self.page_count())
+    return [(measures[n][0], image_tokens(measures[n][1], measures[n][2]))
+            for n in page_numbers]
+
+  async def render(self, start: int, end: int):
+    total = await self.page_count()
+    sha256 = await self.file_sha256()
+    page_numbers = await self.selected_pages(start, end)
+
+    async def render_batch(batch: list):
+      pages = await cpu_pool.run(render_pdf_pages, self.pdf_path, batch, self.encoder.settings, sha256)
+      self._rendered += len(pages)
+      if self.on_progress is not None:
+        self.on_progress(min(self._rendered, total), total)
+      return pages
+
+    batches = await asyncio.gather(*[
+        render_batch(page_numbers[i:i + RENDER_BATCH_PAGES])
+        for i in range(0, len(page_numbers), RENDER_BATCH_PAGES)
+    ])
+    return [self.encoder.blob(page) for batch in batches for page in batch]
+
+  @asynccontextmanager
+  async def pages(self, start: int, end: int):
+    async with self._budget.hold(end - start):
+      yield await self.render(start, end)
+
+
+async def extract_text_pages(pdf_path: str, on_progress=None, classify: tuple = None):
+  """
+  Extract the text of every page in the worker pool, in page ranges spread
+  over the workers, and return (page number, page label, text, needs image)
+  in order, see jobs.extract_pdf_text for `classify`. `on_progress` is
+  called with (extracted, total), throttled.
+  """
+  total = await cpu_pool.run(pdf_page_count, pdf_path)
+  # Two ranges per worker, so a slow range does not hold the others back
+  batch_pages = max(TEXT_BATCH_PAGES, math.ceil(total / (cpu_pool.max_workers * 2)))
+  tasks = [
+      asyncio.ensure_future(cpu_pool.run(extract_pdf_text, pdf_path, start, start + batch_pages, classify))
+      for start in range(0, total, batch_pages)
+  ]
+
+  extracted = 0
+  last_progress = 0
+  try:
+    for task in asyncio.as_completed(tasks):
+      extracted += len(await task)
+      now = time.monotonic()
+      if on_progress is not None and (extracted == total or now - last_progress >= PROGRESS_INTERVAL_SECONDS):
+        last_progress = now
+        on_progress(extracted, total)
+  except BaseException:
+    for task in tasks:
+      task.cancel()
+    raise
+  return [page for task in tasks for page in task.result()]
+
+
+async def classify_pdf(pdf_path: str, on_progress=None):
+  """
+  Split a PDF into pages whose text layer is used, as (page number, page
+  label, text), and the page numbers that have to be sent as images.
+  """
+  pages = await extract_text_pages(
+      pdf_path, on_progress, (PDF_MIN_TEXT_CHARS, PDF_MAX_IMAGE_COVERAGE))
+  text_pages = [(page_number, page_label, text)
+                for page_number, page_label, text, image in pages if not image]
+  image_pages = [page_number for page_number, _, _, image in pages if image]
+  return text_pages, image_pages
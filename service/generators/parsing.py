@@ -0,0 +1,197 @@
+import json
+import re
+
+OPTION_LETTERS = 'ABCDEFGH'
+TITLE_PATTERN = re.compile(r'"title"\s*:\s*("(?:[^"\\]|\\.)*")')
+BACKSLASH_PATTERN = re.compile(r'\\(.?)([a-zA-Z]*)')
+HEX_PATTERN = re.compile(r'[0-9a-fA-F]{4}')
+# LaTeX commands that start like a \n, \r or \t escape. \b and \f are
+# always LaTeX when a letter follows, models do not write those controls
+LATEX_COMMANDS = {
+    'nabla', 'ne', 'neq', 'neg', 'nu', 'ni', 'not', 'notin', 'nexists',
+    'newline', 'noindent', 'nolimits', 'normalsize', 'nmid', 'nleq', 'ngeq',
+    'nsubseteq', 'nparallel',
+    'rho', 'right', 'rightarrow', 'rightleftharpoons', 'rangle', 'rceil',
+    'rfloor', 'rbrace', 'rbrack', 'rm', 'rvert', 'rVert', 'root',
+    'tau', 'theta', 'times', 'text', 'textbf', 'textit', 'textrm', 'texttt',
+    'textsuperscript', 'textsubscript', 'tan', 'tanh', 'tilde', 'to', 'top',
+    'triangle', 'triangleq', 'tfrac', 'therefore', 'tiny', 'tt', 'textstyle',
+}
+
+
+class ParseResult:
+  def __init__(self, questions: list, errors: list, salvaged: bool = False, title: str = None):
+    self.questions = questions
+    self.errors = errors
+    self.title = title
+    # True when the response was not valid JSON and questions were recovered
+    self.salvaged = salvaged
+
+  def summary(self):
+    parts = [f'{len(self.questions)} questions']
+    if self.salvaged:
+      parts.append('salvaged from broken JSON')
+    if self.errors:
+      parts.append(f'{len(self.errors)} dropped: ' + '; '.join(self.errors[:5]))
+    return ', '.join(parts)
+
+
+def strip_fences(text: str):
+  return text.replace('```json', '').replace('```', '').strip()
+
+
+def _escape_backslash(match):
+  char, letters = match.group(1), match.group(2)
+  word = char + letters
+  if char in ('\\', '"', '/'):
+    keep = True
+  elif char == 'u':
+    keep = HEX_PATTERN.match(match.string, match.end(1)) is not None
+  elif char in ('b', 'f'):
+    keep = not letters
+  elif char in ('n', 'r', 't'):
+    keep = word not in LATEX_COMMANDS
+  else:
+    keep = False
+  return match.group(0) if keep else '\\' + match.group(0)
+
+
+def escape_backslashes(text: str):
+  """
+  Double the backslashes of LaTeX in model output, so it survives
+  json.loads: invalid escapes like \\( or \\alpha, and LaTeX commands that
+  are also valid escapes, like \\frac, \\beta or \\nabla, which would
+  decode to control characters. Escaped backslashes and real escapes such
+  as \\n are kept.
+  """
+  return BACKSLASH_PATTERN.sub(_escape_backslash, text)
+
+
+def normalize_answer(answer, options: list):
+  if isinstance(answer, bool):
+    return None
+  if isinstance(answer, int):
+    return answer
+  if isinstance(answer, float) and answer.is_integer():
+    return int(answer)
+  if isinstance(answer, str):
+    answer = answer.strip()
+    if answer.isdigit():
+      return int(answer)
+    if len(answer) == 1 and answer.upper() in OPTION_LETTERS:
+      return OPTION_LETTERS.index(answer.upper())
+    if answer in options:
+      return options.index(answer)
+  return None
+
+
+def validate_question(item):
+  """
+  Return the question in the stored format, or raise ValueError with the
+  reason it is unusable.
+  """
+  if not isinstance(item, dict):
+    raise ValueError('question is not an object')
+
+  question = item.get('question')
+  if not isinstance(question, str) or not question.strip():
+    raise ValueError('missing question text')
+
+  options = item.get('options')
+  if not isinstance(options, list) or len(options) < 2:
+    raise ValueError('options must be a list of at least 2 choices')
+  options = [str(option) for option in options]
+
+  answer = normalize_answer(item.get('answer'), options)
+  if answer is None or not 0 <= answer < len(options):
+    raise ValueError(f"invalid answer {item.get('answer')!r}")
+
+  explanation = item.get('explanation')
+  return {
+      "question": question.strip(),
+      "options": options,
+      "answer": answer,
+      "explanation": explanation if isinstance(explanation, str) else ''
+  }
+
+
+def salvage_objects(text: str):
+  """
+  Decode every top level object of the questions array that is still valid
+  JSON, skipping the broken ones and a truncated tail.
+  """
+  decoder = json.JSONDecoder()
+  start = text.find('[', max(0, text.find('"questions"')))
+  position = start + 1 if start >= 0 else 0
+  items = []
+  while True:
+    position = text.find('{', position)
+    if position < 0:
+      break
+    try:
+      item, end = decoder.raw_decode(text, position)
+    except json.JSONDecodeError:
+      position += 1
+      continue
+    if isinstance(item, dict) and 'question' in item:
+      items.append(item)
+      position = end
+    else:
+      position += 1
+  return items
+
+
+def parse_title(data, text: str):
+  title = data.get('title') if isinstance(data, dict) else None
+  if title is None:
+    match = TITLE_PATTERN.search(text)
+    if match:
+      try:
+        title = json.loads(match.group(1))
+      except json.JSONDecodeError:
+        title = None
+  if not isinstance(title, str) or not title.strip():
+    return None
+  return title.strip()
+
+
+def parse_questions(text: str):
+  """
+  Parse a model response into validated questions. Every question is
+  validated on its own, so one bad question or a partially broken
+  response only loses what is actually broken.
+  """
+  text = strip_fences(text or '')
+  salvaged = False
+  data = None
+  escaped = escape_backslashes(text)
+  try:
+    data = json.loads(escaped)
+  except json.JSONDecodeError:
+    pass
+
+  if isinstance(data, dict):
+    items = data.get('questions', [])
+  elif isinstance(data, list):
+    items = data
+  else:
+    items = salvage_objects(escaped)
+    salvaged = True
+
+  if not isinstance(items, list):
+    return ParseResult([], ['"questions" is not an array'])
+
+  questions = []
+  errors = []
+  for i, item in enumerate(items):
+    try:
+      questions.append(validate_question(item))
+    except ValueError as e:
+      errors.append(f'question {i}: {e}')
+  if salvaged:
+    undecoded = max(0, text.count('"question"') - len(items))
+    if undecoded:
+      errors.append(f'{undecoded} questions could not be decoded')
+    elif not items:
+      errors.append('no question found')
+  return ParseResult(questions, errors, salvaged, parse_title(data, text))
@@ -0,0 +1,148 @@
+import math
+import os
+
+# Document tokens sent in one generation call, well below the model's context
+GEN_CONTEXT_TOKENS = int(os.environ.get('GEN_CONTEXT_TOKENS', '120000'))
+# Questions asked in one call, bounded by the response length
+GEN_MAX_QUESTIONS_PER_CALL = int(
+    os.environ.get('GEN_MAX_QUESTIONS_PER_CALL', '25'))
+
+GOLDEN_RATIO_CONJUGATE = 0.6180339887498949
+
+
+class PlannedCall:
+  def __init__(self, chunk_ids: list, count: int):
+    self.chunk_ids = chunk_ids
+    self.count = count
+
+  def __repr__(self):
+    return f'PlannedCall(chunk_ids={self.chunk_ids}, count={self.count})'
+
+
+def allocate(weights: list, total: int):
+  """
+  Split `total` proportionally to `weights` with the largest remainder
+  method, so the quotas always add up to `total`.
+  """
+  weight_sum = sum(weights)
+  if weight_sum <= 0:
+    weights = [1] * len(weights)
+    weight_sum = len(weights)
+
+  exact = [total * weight / weight_sum for weight in weights]
+  quotas = [math.floor(value) for value in exact]
+  by_remainder = sorted(range(len(weights)),
+                        key=lambda i: exact[i] - quotas[i], reverse=True)
+  for i in by_remainder[:total - sum(quotas)]:
+    quotas[i] += 1
+  return quotas
+
+
+class ChunkPlanner:
+  """
+  Plans the Gemini calls that generate `num_question` questions from a
+  chunked document with as few calls as possible.
+
+  Consecutive chunks are packed into groups of at most `context_tokens`
+  tokens and question quotas are allocated proportionally to the tokens of
+  each group. A call asks for at most `max_questions_per_call` questions,
+  so the minimum number of calls is ceil(num_question / max per call). When
+  the document is bigger than what those calls can read, only the most
+  central chunks (by ranking) that fit are used.
+
+  A group whose quota needs several calls is split between them, so no two
+  calls read the same chunks with the same prompt. A call planned over more
+  questions than one call asks for, when a group has fewer chunks than
+  calls, gets the rest through top-ups that list the questions it already
+  asked.
+  """
+
+  def __init__(self, context_tokens: int = GEN_CONTEXT_TOKENS, max_questions_per_call: int = GEN_MAX_QUESTIONS_PER_CALL):
+    self.context_tokens = context_tokens
+    self.max_questions_per_call = max_questions_per_call
+
+  def min_calls(self, num_question: int):
+    return max(1, math.ceil(num_question / self.max_questions_per_call))
+
+  def needs_ranking(self, token_counts: list, num_question: int):
+    return sum(token_counts) > self.min_calls(num_question) * self.context_tokens
+
+  def select_chunks(self, token_counts: list, num_question: int, ranking: list = None):
+    if not self.needs_ranking(token_counts, num_question):
+      return list(range(len(token_counts)))
+
+    if ranking is None:
+      # No ranking, sample chunks spread evenly over the whole document
+      ranking = sorted(range(len(token_counts)),
+                       key=lambda i: (i * GOLDEN_RATIO_CONJUGATE) % 1)
+
+    capacity = self.min_calls(num_question) * self.context_tokens
+    selected = []
+    used = 0
+    for chunk_id in ranking:
+      if used + token_counts[chunk_id] > capacity:
+        continue
+      selected.append(chunk_id)
+      used += token_counts[chunk_id]
+    if not selected:
+      selected = [ranking[0]]
+    # Back to document order so packed groups read naturally
+    return sorted(selected)
+
+  def pack(self, chunk_ids: list, token_counts: list):
+    groups = []
+    current = []
+    current_tokens = 0
+    for chunk_id in chunk_ids:
+      tokens = token_counts[chunk_id]
+      if current and current_tokens + tokens > self.context_tokens:
+        groups.append(current)
+        current = []
+        current_tokens = 0
+      current.append(chunk_id)
+      current_tokens += tokens
+    if current:
+      groups.append(current)
+    return groups
+
+  def split(self, group: list, token_counts: list, parts: int):
+    """
+    Split a group into `parts` consecutive, non-empty groups of about the
+    same number of tokens. `parts` is at most the number of chunks.
+    """
+    total = sum(token_counts[i] for i in group)
+    groups = []
+    current = []
+    used = 0
+    for position, chunk_id in enumerate(group):
+      current.append(chunk_id)
+      used += token_counts[chunk_id]
+      parts_left = parts - len(groups) - 1
+      chunks_left = len(group) - position - 1
+      if parts_left > 0 and (used >= total * (len(groups) + 1) / parts or chunks_left == parts_left):
+        groups.append(current)
+        current = []
+    groups.append(current)
+    return groups
+
+  def plan(self, token_counts: list, num_question: int, ranking: list = None):
+    if num_question <= 0 or not token_counts:
+      return []
+
+    chunk_ids = self.select_chunks(token_counts, num_question, ranking)
+    groups = self.pack(chunk_ids, token_counts)
+    quotas = allocate(
+        [sum(token_counts[i] for i in group) for group in groups], num_question)
+
+    calls = []
+    for group, quota in zip(groups, quotas):
+      if quota == 0:
+        continue
+      parts = min(len(group), math.ceil(quota / self.max_questions_per_call))
+      subgroups = self.split(group, token_counts, parts)
+      counts = allocate(
+          [sum(token_counts[i] for i in subgroup) for subgroup in subgroups], quota)
+      for subgroup, count in zip(subgroups, counts):
+        if count > 0:
+          calls.append(PlannedCall(subgroup, count))
+    return calls
@@ -0,0 +1,60 @@
+import os
+
+GEMINI_PRO_MODEL = os.environ.get('GEMINI_PRO_MODEL', 'gemini-2.5-pro')
+GEMINI_FLASH_MODEL = os.environ.get('GEMINI_FLASH_MODEL', 'gemini-2.5-flash')
+
+# Model of every stage, the pro model is kept for hard questions
+STAGE_MODELS = {
+    'default': os.environ.get('GEMINI_MODEL_DEFAULT', GEMINI_PRO_MODEL),
+    'generate': os.environ.get('GEMINI_MODEL_GENERATE', GEMINI_FLASH_MODEL),
+    'generate_hard': os.environ.get('GEMINI_MODEL_GENERATE_HARD', GEMINI_PRO_MODEL),
+    'summarize': os.environ.get('GEMINI_MODEL_SUMMARIZE', GEMINI_FLASH_MODEL),
+    'query': os.environ.get('GEMINI_MODEL_QUERY', 'gemini-2.0-flash'),
+}
+
+# Bigger inputs go to GEMINI_MODEL_LARGE_INPUT, pro gets slower and pricier
+GEMINI_LARGE_INPUT_TOKENS = int(
+    os.environ.get('GEMINI_LARGE_INPUT_TOKENS', '200000'))
+GEMINI_MODEL_LARGE_INPUT = os.environ.get(
+    'GEMINI_MODEL_LARGE_INPUT', GEMINI_FLASH_MODEL)
+
+# Tried in order after the routed model when it is overloaded
+GEMINI_FALLBACK_MODELS = [
+    name.strip() for name in os.environ.get(
+        'GEMINI_FALLBACK_MODELS', f'{GEMINI_FLASH_MODEL},{GEMINI_PRO_MODEL}').split(',')
+    if name.strip()
+]
+# Retries on an overloaded model before falling back to the next one
+GEMINI_FALLBACK_AFTER_RETRIES = int(
+    os.environ.get('GEMINI_FALLBACK_AFTER_RETRIES', '1'))
+
+
+class ModelRouter:
+  def __init__(self, stage_models: dict, fallback_models: list, large_input_tokens: int, large_input_model: str):
+    self.stage_models = stage_models
+    self.fallback_models = fallback_models
+    self.large_input_tokens = large_input_tokens
+    self.large_input_model = large_input_model
+
+  def model_for(self, stage: str, difficulty: str = None, input_tokens: int = 0):
+    if stage == 'generate' and difficulty == 'hard':
+      stage = 'generate_hard'
+    model = self.stage_models.get(stage, self.stage_models['default'])
+    if input_tokens > self.large_input_tokens:
+      model = self.large_input_model
+    return model
+
+  def route(self, stage: str, difficulty: str = None, input_tokens: int = 0):
+    """
+    Models to try for a call, the routed one first and then the fallbacks.
+    """
+    model = self.model_for(stage, difficulty, input_tokens)
+    return [model] + [name for name in self.fallback_models if name != model]
+
+
+model_router = ModelRouter(
+    STAGE_MODELS,
+    GEMINI_FALLBACK_MODELS,
+    GEMINI_LARGE_INPUT_TOKENS,
+    GEMINI_MODEL_LARGE_INPUT
+)
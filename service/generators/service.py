@@ -1,5 +1,5 @@
 import os
-from service.generators.base import FileUploader, GenAIClient
+from service.generators.base import FileUploader
 from service.generators.generators import default_prompt, QuestionGenerator, TextProcessor, ImageProcessor, FileProcessor
 from service.generators.summarizer import Summarizer
 from service.generators.doc_processor.docx import DOCXProcessor
@@ -12,7 +12,7 @@ api_key = os.environ.get('GOOGLE_GENAI_KEY')
 
 file_uploader = FileUploader(api_key=api_key)
 generator = QuestionGenerator(api_key=api_key, default_prompt=default_prompt)
-summarizer = Summarizer(api_key=api_key)
+summarizer = Summarizer(api_key=api_key, stage='summarize')
 text_processor = TextProcessor(generator)
 image_processor = ImageProcessor(generator, summarizer, text_processor)
 file_processor = FileProcessor(generator)
@@ -23,4 +23,3 @@ txt_file_processor = TextFileProcessor(
 doc_processor = DOCXProcessor(text_processor, image_processor, file_processor)
 image_generator = ImageGenerator(image_processor)
 link_generator = LinkGenerator(text_processor)
-category_client = GenAIClient(api_key=api_key)
@@ -0,0 +1,29 @@
+from contextvars import ContextVar
+
+# Set by a job that wants every parsed question as soon as its chunk is done
+current_question_sink = ContextVar('current_question_sink', default=None)
+
+
+class QuestionSink:
+  """
+  Receives questions while a quiz is being generated, capped at the
+  requested count. `on_questions` is awaited with every accepted batch.
+  """
+
+  def __init__(self, limit: int, on_questions):
+    self.limit = limit
+    self.on_questions = on_questions
+    self.questions = []
+
+  @property
+  def full(self):
+    return len(self.questions) >= self.limit
+
+  async def add(self, questions: list):
+    # Slice and extend before awaiting so concurrent chunks never overshoot
+    accepted = questions[:max(0, self.limit - len(self.questions))]
+    if not accepted:
+      return []
+    self.questions.extend(accepted)
+    await self.on_questions(accepted)
+    return accepted
@@ -0,0 +1,73 @@
+import json
+import os
+
+from service.generators.parsing import escape_backslashes
+
+# Stream generation responses and extract questions as they complete
+GEN_STREAMING = os.environ.get('GEN_STREAMING', '1') == '1'
+
+
+class QuestionStreamParser:
+  """
+  Incremental extractor of the objects of the "questions" array of a JSON
+  response received in pieces. `feed` returns the objects whose closing
+  brace arrived with the new text, so a question is available as soon as
+  the model finished writing it instead of at the end of the response.
+  """
+
+  def __init__(self):
+    self._buffer = ''
+    self._position = 0
+    self._in_array = False
+    self._depth = 0
+    self._in_string = False
+    self._escaped = False
+    self._object_start = None
+
+  def feed(self, text: str):
+    self._buffer += text
+    items = []
+    buffer = self._buffer
+    i = self._position
+    while i < len(buffer):
+      char = buffer[i]
+      if self._in_string:
+        if self._escaped:
+          self._escaped = False
+        elif char == '\\':
+          self._escaped = True
+        elif char == '"':
+          self._in_string = False
+      elif char == '"':
+        self._in_string = True
+      elif not self._in_array:
+        # Start at the first array of the response, the questions array
+        if char == '[':
+          self._in_array = True
+      elif char == '{':
+        if self._depth == 0:
+          self._object_start = i
+        self._depth += 1
+      elif char == '}' and self._depth > 0:
+        self._depth -= 1
+        if self._depth == 0:
+          item = self._decode(buffer[self._object_start:i + 1])
+          if item is not None:
+            items.append(item)
+          self._object_start = None
+      i += 1
+
+    # Only keep the text of the object still being written
+    keep_from = self._object_start if self._object_start is not None else i
+    self._buffer = buffer[keep_from:]
+    self._position = i - keep_from
+    if self._object_start is not None:
+      self._object_start = 0
+    return items
+
+  @staticmethod
+  def _decode(text: str):
+    try:
+      return json.loads(escape_backslashes(text))
+    except json.JSONDecodeError:
+      return None
@@ -10,9 +10,12 @@ from llama_index.vector_stores.pinecone import PineconeVectorStore
 from llama_index.llms.google_genai import GoogleGenAI
 from llama_index.core.response_synthesizers import get_response_synthesizer
 from llama_index.core.prompts import PromptTemplate
-from llama_index.readers.file import PDFReader, DocxReader, MarkdownReader
+from llama_index.readers.file import MarkdownReader
 from service.generators.base import GenAIClient
-from service.generators.doc_processor.pdf import PDFProcessor
+from service.generators.routing import model_router
+from service.generators.pages import PdfPageSource, batch_ranges, split_by_bytes, classify_pdf, extract_text_pages
+from service.workers.pool import cpu_pool
+from service.workers import jobs
 from pinecone import Pinecone
 import asyncio
 import google.generativeai as genai
@@ -29,7 +32,7 @@ pc = Pinecone(
 )
 
 Settings.llm = GoogleGenAI(
-    model="gemini-2.0-flash",
+    model=model_router.model_for('query'),
     api_key=GOOGLE_GENAI_KEY,
 )
 
@@ -62,12 +65,23 @@ index = VectorStoreIndex.from_vector_store(vector_store=vector_store)
 retriever = VectorIndexRetriever(index=index, similarity_top_k=5)
 query_engine = RetrieverQueryEngine(retriever=retriever)
 
-node_parser = SentenceSplitter(
-    chunk_size=1024,
-    chunk_overlap=20,
-    paragraph_separator="\n\n",
-    secondary_chunking_regex="[^,.;。]+[,.;。]?",
-)
+NODE_CHUNK_SIZE = 1024
+NODE_CHUNK_OVERLAP = 20
+NODE_PARAGRAPH_SEPARATOR = "\n\n"
+NODE_SECONDARY_CHUNKING_REGEX = "[^,.;。]+[,.;。]?"
+
+
+async def split_into_chunks(documents) -> list[Document]:
+  # Sentence splitting is pure Python, keep it off the event loop
+  chunks = await cpu_pool.run(
+      jobs.split_documents,
+      [(doc.text, doc.metadata) for doc in documents],
+      NODE_CHUNK_SIZE,
+      NODE_CHUNK_OVERLAP,
+      NODE_PARAGRAPH_SEPARATOR,
+      NODE_SECONDARY_CHUNKING_REGEX
+  )
+  return [Document(text=text, metadata=metadata) for text, metadata in chunks]
 
 
 async def delete_chunks(document_id: str):
@@ -84,18 +98,19 @@ async def delete_chunks(document_id: str):
     raise Exception(f"Error deleting chunks from Pinecone: {str(e)}")
 
 
-async def process_pdf_images(pdf_path: str, chunk_size: int = 10, chunk_overlap: int = 2) -> list[Document]:
+async def process_pdf_images(pdf_path: str, chunk_size: int = 10, chunk_overlap: int = 2, page_numbers: list = None) -> list[Document]:
   documents = []
 
-  pdf_processor = PDFProcessor(None, None)
-  images = pdf_processor.pdf_to_base64(pdf_path)
-
-  chunks = []
-  i = 0
-  while i < len(images):
-    chunk = images[i:min(len(images), i + chunk_size)]
-    chunks.append(chunk)
-    i += chunk_size - chunk_overlap
+  # Pages are rendered chunk by chunk and released once described
+  source = PdfPageSource(pdf_path, page_numbers=page_numbers)
+  total_pages = await cpu_pool.run(jobs.pdf_page_count, pdf_path)
+  # Blank and repeated pages are not described, numbers are 0-based
+  skipped = await source.skip_redundant()
+  if skipped:
+    print(f'Skipped {len(skipped)} blank or duplicate pages of {pdf_path}: {skipped}')
+  page_numbers = await source.selected_pages(0, await source.page_count())
+  # chunk_size pages at most, less when they would not fit in a request
+  chunks = batch_ranges(await source.page_costs(), chunk_size, chunk_overlap)
 
   genai_client = GenAIClient(
       api_key=GOOGLE_GENAI_KEY,
@@ -105,32 +120,35 @@ async def process_pdf_images(pdf_path: str, chunk_size: int = 10, chunk_overlap:
         2. If there are tables, figures, or diagrams, explain their structure and content
         3. Extract any text that appears in the image
         4. Provide a concise summary of the key concepts
-        """
+        """,
+      stage='summarize'
   )
 
+  async def describe(start: int, end: int):
+    async with source.pages(start, end) as images:
+      # Split when the estimated size of the chunk was too low
+      responses = await asyncio.gather(*[
+          genai_client.generate(part) for part in split_by_bytes(images)
+      ])
+      return '\n'.join(responses)
+
   tasks = []
-  for chunk in chunks:
-    task = genai_client.model.generate_content_async(
-        contents=[{"mime_type": "image/png", "data": img_str}
-                  for img_str in chunk]
-    )
+  for start, end in chunks:
+    task = describe(start, end)
     tasks.append(task)
 
   responses = await asyncio.gather(*tasks, return_exceptions=True)
 
-  for idx, (chunk, response) in enumerate(zip(chunks, responses)):
+  for idx, ((start, end), response) in enumerate(zip(chunks, responses)):
     if isinstance(response, Exception):
       print(f"Error processing chunk {idx}: {str(response)}")
       continue
 
-    start_page = idx * (chunk_size - chunk_overlap) + 1
-    end_page = start_page + len(chunk) - 1
-
     doc = Document(
-        text=response.text,
+        text=response,
         metadata={
-            "pages": list(range(start_page, end_page + 1)),
-            "total_pages": len(images),
+            "pages": [page_number + 1 for page_number in page_numbers[start:end]],
+            "total_pages": total_pages,
             "content_type": "image_summary",
             "has_image": True
         }
@@ -142,40 +160,40 @@ async def process_pdf_images(pdf_path: str, chunk_size: int = 10, chunk_overlap:
 
 async def process_pdf(file_path: str, mode: str = "text") -> list[Document]:
   if mode == "text":
-    reader = PDFReader()
-    documents = reader.load_data(file_path)
+    # Pages are extracted in parallel in the worker pool, off the event loop
+    pages = await extract_text_pages(file_path)
+    documents = [
+        Document(text=text, metadata={"page_label": page_label,
+                                      "file_name": os.path.basename(file_path)})
+        for _, page_label, text, _ in pages if text.strip()
+    ]
+  elif mode == "hybrid":
+    # Digital pages keep their text layer, only the others are described
+    text_pages, image_pages = await classify_pdf(file_path)
+    documents = [
+        Document(text=text, metadata={"page_label": page_label,
+                                      "file_name": os.path.basename(file_path)})
+        for _, page_label, text in text_pages if text.strip()
+    ]
+    if image_pages:
+      documents += await process_pdf_images(file_path, page_numbers=image_pages)
   else:
     documents = await process_pdf_images(file_path)
 
-  nodes = node_parser.get_nodes_from_documents(documents)
-
-  chunked_documents = []
-  for node in nodes:
-    doc = Document(
-        text=node.text,
-        metadata=node.metadata
-    )
-    print('Current chunk: ', node.text)
-    chunked_documents.append(doc)
+  chunked_documents = await split_into_chunks(documents)
+  for doc in chunked_documents:
+    print('Current chunk: ', doc.text)
 
   return chunked_documents
 
 
 async def process_docx(file_path: str) -> list[Document]:
-  reader = DocxReader()
-  documents = reader.load_data(file_path)
+  documents = [
+      Document(text=text, metadata=metadata)
+      for text, metadata in await cpu_pool.run(jobs.docx_documents, file_path)
+  ]
 
-  nodes = node_parser.get_nodes_from_documents(documents)
-
-  chunked_documents = []
-  for node in nodes:
-    doc = Document(
-        text=node.text,
-        metadata=node.metadata
-    )
-    chunked_documents.append(doc)
-
-  return chunked_documents
+  return await split_into_chunks(documents)
 
 
 async def process_text_file(file_path: str) -> list[Document]:
@@ -186,19 +204,9 @@ async def process_text_file(file_path: str) -> list[Document]:
     documents = reader.load_data(file_path)
   else:
     reader = SimpleDirectoryReader(input_files=[file_path])
-    documents = reader.load_data()[0]
+    documents = reader.load_data()[:1]
 
-  nodes = node_parser.get_nodes_from_documents(documents)
-
-  chunked_documents = []
-  for node in nodes:
-    doc = Document(
-        text=node.text,
-        metadata=node.metadata
-    )
-    chunked_documents.append(doc)
-
-  return chunked_documents
+  return await split_into_chunks(documents)
 
 
 async def add_document(doc, user_id, is_public=False, document_id=None, filename=None):
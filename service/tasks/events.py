@@ -0,0 +1,57 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+
+
+class TaskEventBus:
+  """
+  In-process pub/sub of task status updates, used by the streaming status
+  endpoints. Publishing is thread safe because processors also report
+  progress from worker threads.
+  """
+
+  def __init__(self, max_queue_size: int = 100):
+    self.max_queue_size = max_queue_size
+    self._subscribers = {}
+    self._lock = threading.Lock()
+
+  @contextmanager
+  def subscribe(self, task_id: str):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=self.max_queue_size)
+    subscriber = (loop, queue)
+    with self._lock:
+      self._subscribers.setdefault(task_id, set()).add(subscriber)
+    try:
+      yield queue
+    finally:
+      with self._lock:
+        subscribers = self._subscribers.get(task_id)
+        if subscribers is not None:
+          subscribers.discard(subscriber)
+          if not subscribers:
+            del self._subscribers[task_id]
+
+  def publish(self, task_id: str, event: dict):
+    with self._lock:
+      subscribers = list(self._subscribers.get(task_id, ()))
+    if not subscribers:
+      return
+
+    try:
+      current_loop = asyncio.get_running_loop()
+    except RuntimeError:
+      current_loop = None
+
+    for loop, queue in subscribers:
+      if loop is current_loop:
+        self._put(queue, event)
+      elif not loop.is_closed():
+        loop.call_soon_threadsafe(self._put, queue, event)
+
+  @staticmethod
+  def _put(queue: asyncio.Queue, event: dict):
+    # Statuses are snapshots, so a slow consumer can skip the oldest ones
+    if queue.full():
+      queue.get_nowait()
+    queue.put_nowait(event)
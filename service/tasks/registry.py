@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+
+
+def idempotency_key(*parts):
+  """
+  Hash the parts of a request (str, bytes or anything with a stable str)
+  into an idempotency key.
+  """
+  digest = hashlib.sha256()
+  for part in parts:
+    if not isinstance(part, bytes):
+      part = str(part).encode('utf-8')
+    digest.update(len(part).to_bytes(8, 'big'))
+    digest.update(part)
+  return digest.hexdigest()
+
+
+class JobRegistry:
+  """
+  Keeps track of the background jobs of this process.
+
+  Jobs registered with an idempotency key are coalesced: while a job is in
+  flight, registering the same key returns the task id of the running job
+  instead of starting a new one. Every job runs in its own asyncio task so
+  it can be cancelled, which also cancels its pending Gemini calls and
+  releases its scheduler slot.
+  """
+
+  def __init__(self, status_store):
+    self.status_store = status_store
+    self._keys = {}
+    self._task_keys = {}
+    self._pending = set()
+    self._running = {}
+    self._cancel_requested = set()
+    self._on_cancel = {}
+
+  def find(self, key: str):
+    return self._keys.get(key)
+
+  def register(self, task_id: str, key: str = None, on_cancel=None):
+    """
+    `on_cancel`, a function or a coroutine function, is called when the job
+    is cancelled before it starts, to release what the request prepared for
+    it (e.g. its temp file), since the job itself never runs then.
+    """
+    self._pending.add(task_id)
+    if on_cancel is not None:
+      self._on_cancel[task_id] = on_cancel
+    if key is not None:
+      self._keys[key] = task_id
+      self._task_keys[task_id] = key
+
+  async def run(self, task_id: str, fn, *args):
+    self._pending.discard(task_id)
+    if task_id in self._cancel_requested:
+      on_cancel = self._on_cancel.get(task_id)
+      self._finish(task_id)
+      if on_cancel is not None:
+        try:
+          result = on_cancel()
+          if asyncio.iscoroutine(result):
+            await result
+        except Exception as e:
+          print(f"Error cleaning up cancelled task {task_id}: {str(e)}")
+      return
+
+    task = asyncio.ensure_future(fn(*args))
+    self._running[task_id] = task
+    try:
+      await task
+    except asyncio.CancelledError:
+      if task_id not in self._cancel_requested:
+        raise
+      self.status_store[task_id] = {
+          "status": "cancelled",
+          "message": "Task cancelled by user"
+      }
+    finally:
+      self._finish(task_id)
+
+  def cancel(self, task_id: str):
+    task = self._running.get(task_id)
+    if task is not None:
+      if task.done():
+        return False
+      self._cancel_requested.add(task_id)
+      task.cancel()
+      return True
+
+    if task_id in self._pending:
+      # Not started yet, run() will skip it
+      self._cancel_requested.add(task_id)
+      self._release_key(task_id)
+      self.status_store[task_id] = {
+          "status": "cancelled",
+          "message": "Task cancelled by user"
+      }
+      return True
+
+    return False
+
+  def _release_key(self, task_id: str):
+    key = self._task_keys.pop(task_id, None)
+    if key is not None and self._keys.get(key) == task_id:
+      del self._keys[key]
+
+  def _finish(self, task_id: str):
+    self._running.pop(task_id, None)
+    self._cancel_requested.discard(task_id)
+    self._on_cancel.pop(task_id, None)
+    self._release_key(task_id)
@@ -0,0 +1,181 @@
+import asyncio
+import os
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from itertools import zip_longest
+
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+JOB_POOLS = {
+    'generate': int(os.environ.get('SCHEDULER_GENERATE_CONCURRENCY', '2')),
+    'ingest': int(os.environ.get('SCHEDULER_INGEST_CONCURRENCY', '1')),
+    'query': int(os.environ.get('SCHEDULER_QUERY_CONCURRENCY', '4')),
+}
+
+# Uploads bigger than this are scheduled behind smaller jobs of the same pool
+LARGE_JOB_BYTES = int(os.environ.get(
+    'SCHEDULER_LARGE_JOB_BYTES', str(10 * 1024 * 1024)))
+
+
+def priority_for_size(num_bytes: int):
+  return PRIORITY_LOW if num_bytes > LARGE_JOB_BYTES else PRIORITY_NORMAL
+
+
+class _Waiter:
+  def __init__(self, task_id: str, user_id: str, priority: int):
+    self.task_id = task_id
+    self.user_id = user_id
+    self.priority = priority
+    self.future = asyncio.get_running_loop().create_future()
+    self.position = None
+
+
+class JobPool:
+  """
+  Concurrency limited pool with fair queuing.
+
+  Waiters are grouped by priority (lower runs first) and, inside a
+  priority, by user. Users are served round-robin, so one user queuing many
+  jobs only delays their own jobs.
+  """
+
+  def __init__(self, name: str, max_concurrency: int, on_position=None):
+    if max_concurrency < 1:
+      raise ValueError(f'Pool {name} needs at least one slot')
+    self.name = name
+    self.max_concurrency = max_concurrency
+    self.on_position = on_position
+    self._running = 0
+    self._queues = {}
+
+  @property
+  def running(self):
+    return self._running
+
+  @property
+  def waiting(self):
+    return sum(len(waiters) for users in self._queues.values() for waiters in users.values())
+
+  def _ordered_waiters(self):
+    for priority in sorted(self._queues):
+      users = self._queues[priority]
+      for round_ in zip_longest(*users.values()):
+        for waiter in round_:
+          if waiter is not None:
+            yield waiter
+
+  def _enqueue(self, waiter: _Waiter):
+    users = self._queues.setdefault(waiter.priority, OrderedDict())
+    users.setdefault(waiter.user_id, deque()).append(waiter)
+
+  def _remove(self, waiter: _Waiter):
+    users = self._queues.get(waiter.priority)
+    if not users or waiter.user_id not in users:
+      return
+    waiters = users[waiter.user_id]
+    if waiter in waiters:
+      waiters.remove(waiter)
+    if not waiters:
+      del users[waiter.user_id]
+    if not users:
+      del self._queues[waiter.priority]
+
+  def _pop_next(self):
+    while self._queues:
+      priority = min(self._queues)
+      users = self._queues[priority]
+      user_id, waiters = next(iter(users.items()))
+      waiter = waiters.popleft()
+      # Move the user to the back of the round
+      del users[user_id]
+      if waiters:
+        users[user_id] = waiters
+      if not users:
+        del self._queues[priority]
+      if not waiter.future.done():
+        return waiter
+    return None
+
+  def _report_positions(self):
+    if self.on_position is None:
+      return
+    for position, waiter in enumerate(self._ordered_waiters(), start=1):
+      if waiter.position != position:
+        waiter.position = position
+        self.on_position(waiter.task_id, self.name, position)
+
+  async def acquire(self, user_id: str, task_id: str, priority: int = PRIORITY_NORMAL):
+    if self._running < self.max_concurrency and not self._queues:
+      self._running += 1
+      return
+
+    waiter = _Waiter(task_id, user_id, priority)
+    self._enqueue(waiter)
+    self._report_positions()
+    try:
+      await waiter.future
+    except asyncio.CancelledError:
+      if waiter.future.done() and not waiter.future.cancelled():
+        # The slot was handed over right before the cancellation
+        self.release()
+      else:
+        self._remove(waiter)
+        self._report_positions()
+      raise
+
+  def release(self):
+    waiter = self._pop_next()
+    if waiter is None:
+      self._running -= 1
+    else:
+      # Hand the slot over directly, the running count stays the same
+      waiter.future.set_result(None)
+    self._report_positions()
+
+
+class JobScheduler:
+  """
+  One pool per job class (generate, ingest, query), so cheap RAG queries
+  never wait behind large document jobs.
+  """
+
+  def __init__(self, status_store=None, pools: dict = None):
+    self.status_store = status_store
+    self.pools = {
+        name: JobPool(name, size, self._on_position)
+        for name, size in (pools or JOB_POOLS).items()
+    }
+
+  def _on_position(self, task_id: str, pool: str, position: int):
+    if self.status_store is None or not task_id:
+      return
+    self.status_store[task_id] = {
+        "status": "in_queue",
+        "queue": pool,
+        "queue_position": position
+    }
+
+  @asynccontextmanager
+  async def slot(self, job_class: str, user_id: str, task_id: str = None, priority: int = PRIORITY_NORMAL):
+    pool = self.pools.get(job_class)
+    if pool is None:
+      raise ValueError(f"Unknown job class: {job_class}")
+
+    await pool.acquire(user_id, task_id, priority)
+    try:
+      yield
+    finally:
+      pool.release()
+
+  def stats(self):
+    return {
+        name: {
+            "running": pool.running,
+            "waiting": pool.waiting,
+            "max_concurrency": pool.max_concurrency
+        }
+        for name, pool in self.pools.items()
+    }
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+TASK_STORE_BACKEND = os.environ.get('TASK_STORE_BACKEND', 'memory').lower()
+TASK_STORE_MAX_SIZE = int(os.environ.get('TASK_STORE_MAX_SIZE', '10000'))
+TASK_STORE_TTL_SECONDS = int(
+    os.environ.get('TASK_STORE_TTL_SECONDS', str(24 * 60 * 60)))
+TASK_STORE_SQLITE_PATH = os.environ.get('TASK_STORE_SQLITE_PATH', 'tasks.db')
+
+
+class MemoryTier:
+  """
+  LRU dictionary bounded by both size and age. Every write refreshes the
+  expiry of a task, so long running jobs that keep reporting progress are
+  never evicted while they are still alive.
+  """
+
+  def __init__(self, max_size: int, ttl_seconds: int):
+    self.max_size = max_size
+    self.ttl_seconds = ttl_seconds
+    self._items = OrderedDict()
+    # Progress updates are written from worker threads (asyncio.to_thread)
+    self._lock = threading.Lock()
+
+  def get(self, task_id: str):
+    with self._lock:
+      item = self._items.get(task_id)
+      if item is None:
+        return None
+      expires_at, value = item
+      if expires_at <= time.monotonic():
+        del self._items[task_id]
+        return None
+      self._items.move_to_end(task_id)
+      return value
+
+  def set(self, task_id: str, value: dict):
+    with self._lock:
+      self._items[task_id] = (time.monotonic() + self.ttl_seconds, value)
+      self._items.move_to_end(task_id)
+      self._evict()
+
+  def delete(self, task_id: str):
+    with self._lock:
+      return self._items.pop(task_id, None) is not None
+
+  def _evict(self):
+    while len(self._items) > self.max_size:
+      self._items.popitem(last=False)
+
+    now = time.monotonic()
+    while self._items:
+      expires_at, _ = next(iter(self._items.values()))
+      if expires_at > now:
+        break
+      self._items.popitem(last=False)
+
+  def __len__(self):
+    return len(self._items)
+
+
+class MongoTaskTier:
+  def __init__(self, ttl_seconds: int):
+    # Imported lazily so the memory backend works without a Mongo connection
+    from models import tasks
+    self.tasks = tasks
+    self.ttl_seconds = ttl_seconds
+
+  async def get(self, task_id: str):
+    return await self.tasks.get_task(task_id)
+
+  async def set(self, task_id: str, value: dict):
+    await self.tasks.save_task(task_id, value, self.ttl_seconds)
+
+  async def delete(self, task_id: str):
+    return await self.tasks.delete_task(task_id)
+
+
+class SQLiteTaskTier:
+  """
+  Local stand-in for the Mongo tier. The database file can be shared by all
+  uvicorn workers of a single box.
+  """
+
+  PURGE_EVERY = 500
+
+  def __init__(self, path: str, ttl_seconds: int):
+    self.path = path
+    self.ttl_seconds = ttl_seconds
+    self._lock = threading.Lock()
+    self._writes = 0
+    self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    self._conn.execute('PRAGMA journal_mode=WAL')
+    self._conn.execute(
+        'CREATE TABLE IF NOT EXISTS tasks ('
+        'task_id TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)')
+    self._conn.execute(
+        'CREATE INDEX IF NOT EXISTS tasks_expires_at ON tasks (expires_at)')
+    self._conn.commit()
+
+  def _get(self, task_id: str):
+    with self._lock:
+      row = self._conn.execute(
+          'SELECT value FROM tasks WHERE task_id = ? AND expires_at > ?',
+          (task_id, time.time())
+      ).fetchone()
+    return json.loads(row[0]) if row else None
+
+  def _set(self, task_id: str, value: dict):
+    payload = json.dumps(value, default=str)
+    with self._lock:
+      self._conn.execute(
+          'INSERT OR REPLACE INTO tasks (task_id, value, expires_at) VALUES (?, ?, ?)',
+          (task_id, payload, time.time() + self.ttl_seconds)
+      )
+      self._writes += 1
+      if self._writes % self.PURGE_EVERY == 0:
+        self._conn.execute(
+            'DELETE FROM tasks WHERE expires_at <= ?', (time.time(),))
+      self._conn.commit()
+
+  def _delete(self, task_id: str):
+    with self._lock:
+      cursor = self._conn.execute(
+          'DELETE FROM tasks WHERE task_id = ?', (task_id,))
+      self._conn.commit()
+    return cursor.rowcount > 0
+
+  async def get(self, task_id: str):
+    return await asyncio.to_thread(self._get, task_id)
+
+  async def set(self, task_id: str, value: dict):
+    await asyncio.to_thread(self._set, task_id, value)
+
+  async def delete(self, task_id: str):
+    return await asyncio.to_thread(self._delete, task_id)
+
+
+class TaskStore:
+  """
+  Status store behind /status/{task_id}.
+
+  It keeps the dictionary interface of the old module-level `task_results`
+  so processors can keep writing `task_results[task_id] = {...}` from both
+  coroutines and worker threads. Reads are served from the in-memory LRU
+  tier; writes are copied to the persistent tier in the background, where
+  several updates of the same task are coalesced into a single write.
+  Use `fetch` to also look up tasks started by another worker or node;
+  those are never copied into the memory tier, which only holds tasks
+  owned by this process and therefore never goes stale.
+  """
+
+  def __init__(self, memory: MemoryTier, persistent=None, events=None):
+    self.memory = memory
+    self.persistent = persistent
+    self.events = events
+    self._lock = threading.Lock()
+    self._pending = {}
+    self._flushing = False
+    self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+  def __setitem__(self, task_id: str, value: dict):
+    self.memory.set(task_id, value)
+    if self.events is not None:
+      self.events.publish(task_id, value)
+    if self.persistent is None:
+      return
+
+    with self._lock:
+      self._pending[task_id] = value
+      start_flush = not self._flushing
+      self._flushing = True
+    if start_flush:
+      self._start_flush()
+
+  def __getitem__(self, task_id: str):
+    value = self.memory.get(task_id)
+    if value is None:
+      raise KeyError(task_id)
+    return value
+
+  def __contains__(self, task_id: str):
+    return self.memory.get(task_id) is not None
+
+  def __delitem__(self, task_id: str):
+    if not self.memory.delete(task_id):
+      raise KeyError(task_id)
+    with self._lock:
+      self._pending.pop(task_id, None)
+
+  def __len__(self):
+    return len(self.memory)
+
+  def get(self, task_id: str, default=None):
+    value = self.memory.get(task_id)
+    return default if value is None else value
+
+  async def fetch(self, task_id: str):
+    value = self.memory.get(task_id)
+    if value is not None or self.persistent is None:
+      return value
+
+    with self._lock:
+      if task_id in self._pending:
+        return self._pending[task_id]
+
+    return await self.persistent.get(task_id)
+
+  async def delete(self, task_id: str):
+    self.memory.delete(task_id)
+    with self._lock:
+      self._pending.pop(task_id, None)
+    if self.persistent is not None:
+      await self.persistent.delete(task_id)
+
+  def _start_flush(self):
+    try:
+      loop = asyncio.get_running_loop()
+    except RuntimeError:
+      loop = None
+
+    if loop is not None:
+      self._loop = loop
+      loop.create_task(self._flush())
+    elif self._loop is not None and not self._loop.is_closed():
+      # Called from a worker thread, hand the write back to the event loop
+      self._loop.call_soon_threadsafe(
+          lambda: self._loop.create_task(self._flush()))
+    else:
+      with self._lock:
+        self._flushing = False
+
+  async def _flush(self):
+    while True:
+      with self._lock:
+        if not self._pending:
+          self._flushing = False
+          return
+        batch = self._pending
+        self._pending = {}
+
+      for task_id, value in batch.items():
+        try:
+          await self.persistent.set(task_id, value)
+        except Exception as e:
+          print(f"Error persisting task {task_id}: {str(e)}")
+
+
+def create_task_store(events=None):
+  memory = MemoryTier(TASK_STORE_MAX_SIZE, TASK_STORE_TTL_SECONDS)
+
+  if TASK_STORE_BACKEND == 'mongo':
+    persistent = MongoTaskTier(TASK_STORE_TTL_SECONDS)
+  elif TASK_STORE_BACKEND == 'sqlite':
+    persistent = SQLiteTaskTier(TASK_STORE_SQLITE_PATH, TASK_STORE_TTL_SECONDS)
+  elif TASK_STORE_BACKEND == 'memory':
+    persistent = None
+  else:
+    raise ValueError(f"Unsupported TASK_STORE_BACKEND: {TASK_STORE_BACKEND}")
+
+  return TaskStore(memory, persistent, events)
@@ -0,0 +1,195 @@
+"""
+CPU bound jobs executed by the process pool in service.workers.pool.
+
+Jobs are top-level functions that only take and return picklable values
+(paths, strings, lists), and import their heavy dependencies lazily so a
+freshly spawned worker only loads what the job needs.
+"""
+
+
+def render_pdf_pages(pdf_path: str, page_numbers: list, encoder_settings: tuple, file_sha256: str = None):
+  """
+  Render the pages with the ImageEncoder of `encoder_settings` and return
+  the encoded bytes of every page. With the `file_sha256` of the PDF, pages
+  are read from and stored in the page cache.
+  """
+  from service.generators.page_cache import page_cache, page_key
+
+  use_cache = page_cache.enabled and file_sha256 is not None
+  keys = [page_key(file_sha256, page_number, encoder_settings)
+          for page_number in page_numbers] if use_cache else []
+  pages = [page_cache.get(key) for key in keys] if use_cache else [None] * len(page_numbers)
+  missing = [i for i, page in enumerate(pages) if page is None]
+  if not missing:
+    return pages
+
+  import fitz
+  from service.generators.images import ImageEncoder
+
+  encoder = ImageEncoder(*encoder_settings)
+  with fitz.open(pdf_path) as pdf_document:
+    for i in missing:
+      pages[i] = encoder.render_page(pdf_document.load_page(page_numbers[i]))
+      if use_cache:
+        try:
+          page_cache.set(keys[i], pages[i])
+        except OSError as e:
+          print(f"Error writing page cache: {str(e)}")
+  return pages
+
+
+def needs_image(page, text: str, min_text_chars: int, max_image_coverage: float):
+  """
+  Whether a page has to be sent as an image: its text layer is too sparse
+  for its size (a scan) or pictures cover too much of it (figures).
+  """
+  import fitz
+
+  # Text density is measured against a US letter page
+  letter_area = 612 * 792
+  rect = page.rect
+  area = max(rect.width * rect.height, 1)
+  density = len(text.strip()) * letter_area / area
+  covered = 0
+  for image in page.get_image_info():
+    bbox = fitz.Rect(image['bbox']) & rect
+    if not bbox.is_empty:
+      covered += bbox.width * bbox.height
+  coverage = min(1.0, covered / area)
+  return density < min_text_chars or coverage > max_image_coverage
+
+
+def extract_pdf_text(pdf_path: str, start: int, end: int, classify: tuple = None):
+  """
+  Return (page number, page label, text, needs image) for pages [start,
+  end). With `classify`, (min text chars, max image coverage), pages are
+  classified by `needs_image` and the text of image pages is dropped;
+  otherwise no page needs an image.
+  """
+  import fitz
+
+  with fitz.open(pdf_path) as pdf_document:
+    pages = []
+    for page_number in range(start, min(end, pdf_document.page_count)):
+      page = pdf_document.load_page(page_number)
+      text = page.get_text()
+      image = classify is not None and needs_image(page, text, *classify)
+      pages.append((page_number, page.get_label() or str(page_number + 1),
+                    '' if image else text, image))
+    return pages
+
+
+def measure_pdf_pages(pdf_path: str, page_numbers: list, encoder_settings: tuple, file_sha256: str = None, with_signature: bool = False):
+  """
+  Return (encoded bytes, width, height, signature) of the pages without
+  rendering them all. Pages already in the page cache have their actual
+  size; the first other page is rendered as a sample, and the size of the
+  rest is estimated from their dimensions scaled by that sample. The
+  signature is the one of service.generators.page_filter.
+  """
+  import fitz
+  from service.generators.images import ImageEncoder
+  from service.generators.page_cache import page_cache, page_key
+  from service.generators.page_filter import pixmap_signature
+
+  encoder = ImageEncoder(*encoder_settings)
+  use_cache = page_cache.enabled and file_sha256 is not None
+  ratio = None
+  pages = []
+  with fitz.open(pdf_path) as pdf_document:
+    for page_number in page_numbers:
+      page = pdf_document.load_page(page_number)
+      width, height = encoder.page_dimensions(page)
+      estimate = max(1, encoder.estimate_bytes(width, height))
+      key = page_key(file_sha256, page_number, encoder_settings) if use_cache else None
+      size = page_cache.size(key) if use_cache else None
+      if size is None and ratio is None:
+        data = encoder.render_page(page)
+        if use_cache:
+          try:
+            page_cache.set(key, data)
+          except OSError as e:
+            print(f"Error writing page cache: {str(e)}")
+        size = len(data)
+      if ratio is None:
+        ratio = size / estimate
+      if size is None:
+        size = int(estimate * ratio)
+      signature = pixmap_signature(page) if with_signature else None
+      pages.append((size, width, height, signature))
+  return pages
+
+
+def image_signatures(images: list):
+  from service.generators.page_filter import image_signature
+
+  signatures = []
+  for data in images:
+    try:
+      signatures.append(image_signature(data))
+    except Exception:
+      # Unreadable by PIL, send it as is
+      signatures.append(None)
+  return signatures
+
+
+def pdf_page_count(pdf_path: str):
+  import fitz
+
+  with fitz.open(pdf_path) as pdf_document:
+    return pdf_document.page_count
+
+
+def docx_to_text(docx_path: str):
+  return ''.join(text + '\n' for text, _ in docx_documents(docx_path))
+
+
+def docx_documents(docx_path: str):
+  from llama_index.readers.file import DocxReader
+
+  docx_docs = DocxReader().load_data(docx_path)
+  return [(doc.text, doc.metadata) for doc in docx_docs]
+
+
+def split_documents(documents, chunk_size: int, chunk_overlap: int, paragraph_separator: str = None, secondary_chunking_regex: str = None):
+  """
+  Split (text, metadata) pairs with llama-index's SentenceSplitter and
+  return the chunks as (text, metadata) pairs.
+  """
+  from llama_index.core import Document
+  from llama_index.core.node_parser import SentenceSplitter
+
+  kwargs = {}
+  if paragraph_separator is not None:
+    kwargs['paragraph_separator'] = paragraph_separator
+  if secondary_chunking_regex is not None:
+    kwargs['secondary_chunking_regex'] = secondary_chunking_regex
+
+  splitter = SentenceSplitter(
+      chunk_size=chunk_size,
+      chunk_overlap=chunk_overlap,
+      **kwargs
+  )
+  docs = [Document(text=text, metadata=metadata or {})
+          for text, metadata in documents]
+  nodes = splitter.get_nodes_from_documents(docs)
+  return [(node.text, node.metadata) for node in nodes]
+
+
+def rank_chunks(chunks_text):
+  from service.generators.ranking import rank_chunks as textrank
+
+  return textrank(chunks_text)
+
+
+def count_tokens(texts):
+  """
+  Token count of every text with the tokenizer SentenceSplitter chunks with,
+  falling back to ~4 characters per token.
+  """
+  try:
+    from llama_index.core.utils import get_tokenizer
+    tokenizer = get_tokenizer()
+  except Exception:
+    return [len(text) // 4 + 1 for text in texts]
+  return [len(tokenizer(text)) for text in texts]
@@ -0,0 +1,96 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+CPU_WORKERS = int(os.environ.get('CPU_WORKERS', str(os.cpu_count() or 1)))
+# Heap (data segment) limit of every worker process, 0 disables the limit
+CPU_WORKER_MEMORY_MB = int(os.environ.get('CPU_WORKER_MEMORY_MB', '0'))
+# Workers are recycled after this many jobs to give fragmented memory back
+CPU_WORKER_MAX_TASKS = int(os.environ.get('CPU_WORKER_MAX_TASKS', '50'))
+
+
+def _init_worker(memory_limit_mb: int):
+  # Jobs run one per process, BLAS thread pools would only reserve memory
+  # and oversubscribe the cores
+  for name in ('OPENBLAS_NUM_THREADS', 'OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ[name] = '1'
+
+  if memory_limit_mb <= 0:
+    return
+  try:
+    import resource
+  except ImportError:
+    # Not available on Windows, run without a limit
+    return
+  # RLIMIT_DATA bounds what is allocated, unlike RLIMIT_AS which also
+  # counts the address space thread stacks and libraries only reserve
+  limit = memory_limit_mb * 1024 * 1024
+  resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+
+
+class ProcessWorkerPool:
+  """
+  Process pool for CPU bound document work (rendering, parsing, ranking).
+
+  Each worker process runs one job at a time, so the heap limit of a worker is
+  the memory limit of a job. A job that exceeds it fails with
+  MemoryError; if a worker dies instead, the pool is rebuilt for the next
+  job.
+  """
+
+  def __init__(self, max_workers: int, memory_limit_mb: int = 0, max_tasks_per_child: int = 0):
+    self.max_workers = max(1, max_workers)
+    self.memory_limit_mb = memory_limit_mb
+    self.max_tasks_per_child = max_tasks_per_child
+    self._executor = None
+    self._lock = threading.Lock()
+
+  def _get_executor(self):
+    with self._lock:
+      if self._executor is None:
+        kwargs = {}
+        if self.max_tasks_per_child > 0:
+          kwargs['max_tasks_per_child'] = self.max_tasks_per_child
+        # spawn: forking a process that already runs the event loop and
+        # client threads is not safe
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.memory_limit_mb,),
+            **kwargs
+        )
+      return self._executor
+
+  def _reset(self, executor):
+    with self._lock:
+      if self._executor is executor:
+        self._executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+  async def run(self, fn, *args, **kwargs):
+    executor = self._get_executor()
+    loop = asyncio.get_running_loop()
+    try:
+      return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+    except BrokenProcessPool:
+      self._reset(executor)
+      if self.memory_limit_mb > 0:
+        raise Exception(
+            f"Worker process crashed while running {fn.__name__}, it may have exceeded {self.memory_limit_mb} MB")
+      raise Exception(f"Worker process crashed while running {fn.__name__}")
+
+  def shutdown(self):
+    with self._lock:
+      executor = self._executor
+      self._executor = None
+    if executor is not None:
+      executor.shutdown(wait=False, cancel_futures=True)
+
+
+cpu_pool = ProcessWorkerPool(
+    CPU_WORKERS, CPU_WORKER_MEMORY_MB, CPU_WORKER_MAX_TASKS)
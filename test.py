@@ -46,8 +46,8 @@ class GeminiAPITester:
       prompt = "Explain what is photosynthesis in 2 sentences."
       print(f"Prompt: {prompt}")
 
-      response = await self.genai_client.model.generate_content_async(contents=prompt)
-      print(f"\nResponse:\n{response.text}\n")
+      response_text = await self.genai_client.generate(prompt)
+      print(f"\nResponse:\n{response_text}\n")
       print("✓ Test 1 PASSED\n")
       return True
     except Exception as e:
@@ -160,9 +160,9 @@ class GeminiAPITester:
       print(f"Requesting summary...\n")
 
       prompt = "Summarize the following text in 2-3 sentences:\n\n" + long_text
-      response = await self.genai_client.model.generate_content_async(contents=prompt)
+      response_text = await self.genai_client.generate(prompt)
 
-      print(f"Summary:\n{response.text}\n")
+      print(f"Summary:\n{response_text}\n")
       print("✓ Test 4 PASSED\n")
       return True
     except Exception as e:
@@ -0,0 +1,36 @@
+from service.generators.dedup import QuestionDeduplicator
+
+
+def question(stem: str, options: list, answer: int = 0):
+  return {'question': stem, 'options': options, 'answer': answer}
+
+
+def test_short_stems_differing_in_a_number_are_kept():
+  dedup = QuestionDeduplicator()
+  assert dedup.add(question('What is 2+3?', ['4', '5', '6', '7'], 1))
+  assert dedup.add(question('What is 2+5?', ['6', '7', '8', '9'], 1))
+
+
+def test_generic_stem_with_different_options_is_kept():
+  dedup = QuestionDeduplicator()
+  stem = 'Which of the following statements is correct?'
+  assert dedup.add(question(stem, [
+      'Mitochondria produce ATP', 'Ribosomes store DNA', 'The nucleus digests proteins', 'Lysosomes make lipids']))
+  assert dedup.add(question(stem, [
+      'The French Revolution began in 1789', 'Napoleon was born in Paris',
+      'The Bastille fell in 1815', 'Louis XVI died in 1850']))
+
+
+def test_near_duplicate_is_dropped():
+  dedup = QuestionDeduplicator()
+  options = ['Photosynthesis', 'Respiration', 'Fermentation', 'Transpiration']
+  assert dedup.add(question(
+      'Which process do plants use to turn sunlight into chemical energy?', options))
+  assert not dedup.add(question(
+      'Which process do plants use to turn sunlight into chemical energy ?', list(reversed(options)), 3))
+
+
+def test_same_short_question_is_dropped():
+  dedup = QuestionDeduplicator()
+  assert dedup.add(question('What is 2+3?', ['4', '5', '6'], 1))
+  assert not dedup.add(question('What is 2+3?', ['4', '5', '6'], 1))
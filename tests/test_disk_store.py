@@ -0,0 +1,27 @@
+import os
+
+from service.generators.disk_store import DiskStore
+
+
+def stored_bytes(directory: str):
+  return sum(
+      os.path.getsize(os.path.join(root, name))
+      for root, _, files in os.walk(directory) for name in files if name.endswith('.txt'))
+
+
+def test_usage_is_shared_by_stores_of_the_same_directory(tmp_path):
+  # Two stores stand for two worker processes sharing the directory
+  first = DiskStore(str(tmp_path), 10_000, '.txt')
+  second = DiskStore(str(tmp_path), 10_000, '.txt')
+  for i in range(30):
+    store = first if i % 2 else second
+    store.set(f'{i:04d}key', b'x' * 1000)
+  assert stored_bytes(str(tmp_path)) <= 10_000
+
+
+def test_overwrite_does_not_count_twice(tmp_path):
+  store = DiskStore(str(tmp_path), 10_000, '.txt')
+  for _ in range(20):
+    store.set('samekey', b'x' * 1000)
+  assert store.get('samekey') == b'x' * 1000
+  assert store._update_usage(lambda usage: usage) == 1000
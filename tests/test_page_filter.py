@@ -0,0 +1,62 @@
+import numpy as np
+
+from service.generators.page_filter import HASH_SIZE, gray_signature, redundant_pages
+
+
+def page():
+  # A slide template: white page with a title bar
+  gray = np.full((128, 96), 255, dtype=np.uint8)
+  gray[4:16, 4:92] = 40
+  return gray
+
+
+def signature_from_bits(bits, ink: float = 0.1):
+  return np.packbits(np.array(bits, dtype=bool)).tobytes(), ink
+
+
+def test_blank_pages_are_skipped():
+  blank = np.full((128, 96), 255, dtype=np.uint8)
+  slide = page()
+  slide[40:80, 10:60] = 0
+  assert redundant_pages([gray_signature(blank), gray_signature(slide)]) == {0: 'blank'}
+
+
+def test_slide_build_keeps_the_fullest_step():
+  first = page()
+  first[30:45, 10:80] = 0
+  second = first.copy()
+  second[50:55, 10:80] = 0
+  assert redundant_pages([gray_signature(first), gray_signature(second)]) == {0: 1}
+
+
+def test_distinct_slides_on_the_same_template_are_kept():
+  slides = []
+  for layout in range(5):
+    slide = page()
+    if layout == 0:
+      slide[40:120, 8:40] = 0
+    elif layout == 1:
+      slide[40:120, 56:88] = 0
+    elif layout == 2:
+      slide[40:60, 8:88] = 0
+      slide[90:110, 8:88] = 0
+    elif layout == 3:
+      slide[60:100, 30:70] = 0
+    else:
+      # Bullet lines of different lengths
+      for row, length in zip(range(40, 120, 12), (80, 40, 70, 30, 60, 50, 20)):
+        slide[row:row + 4, 8:8 + length] = 0
+    slides.append(gray_signature(slide))
+  assert redundant_pages(slides) == {}
+
+
+def test_chains_do_not_merge_distant_pages():
+  bits = 2 * HASH_SIZE * HASH_SIZE
+  step = int(bits * 0.03)
+  a = [0] * bits
+  b = [1] * step + [0] * (bits - step)
+  c = [1] * (2 * step) + [0] * (bits - 2 * step)
+  # B is close to A and C, A and C are too far apart, ink grows along the chain
+  signatures = [signature_from_bits(a, 0.1), signature_from_bits(b, 0.2),
+                signature_from_bits(c, 0.3)]
+  assert redundant_pages(signatures, max_distance=0.04) == {0: 1}
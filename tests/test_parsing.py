@@ -0,0 +1,55 @@
+from service.generators.parsing import escape_backslashes, parse_questions
+from service.generators.streaming import QuestionStreamParser
+
+
+def response(question: str, explanation: str = ''):
+  return (
+      '{"title": "Math", "questions": [{"question": "' + question + '", '
+      '"options": ["A", "B"], "answer": 0, "explanation": "' + explanation + '"}]}'
+  )
+
+
+def parsed_question(text: str):
+  result = parse_questions(text)
+  assert len(result.questions) == 1, result.summary()
+  return result.questions[0]
+
+
+def test_frac_is_not_a_form_feed():
+  question = parsed_question(response(r'Compute \frac{1}{2} + \beta'))
+  assert question['question'] == r'Compute \frac{1}{2} + \beta'
+
+
+def test_beta_is_not_a_backspace():
+  question = parsed_question(response(r'What is \beta?'))
+  assert question['question'] == r'What is \beta?'
+
+
+def test_nabla_is_not_a_newline():
+  question = parsed_question(response(r'Evaluate \nabla f and \theta'))
+  assert question['question'] == r'Evaluate \nabla f and \theta'
+
+
+def test_escaped_backslash_next_to_invalid_escape():
+  # \\alpha is already escaped and must not be tripled by the \( fix
+  question = parsed_question(response(r'Is \\alpha in \(S\)?'))
+  assert question['question'] == r'Is \alpha in \(S\)?'
+
+
+def test_real_escapes_are_kept():
+  question = parsed_question(response(
+      r'Line one\nSecond line\tTab \"quoted\" é', r'Ends\n'))
+  assert question['question'] == 'Line one\nSecond line\tTab "quoted" é'
+  assert question['explanation'] == 'Ends\n'
+
+
+def test_escape_backslashes_keeps_valid_json():
+  text = r'{"a": "\\frac \n \/ A"}'
+  assert escape_backslashes(text) == text
+
+
+def test_stream_parser_keeps_latex():
+  parser = QuestionStreamParser()
+  text = response(r'Compute \frac{1}{2}')
+  items = parser.feed(text[:40]) + parser.feed(text[40:])
+  assert items[0]['question'] == r'Compute \frac{1}{2}'
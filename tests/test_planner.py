@@ -0,0 +1,25 @@
+from service.generators.planner import ChunkPlanner, allocate
+
+
+def test_allocate_adds_up():
+  assert allocate([1, 1, 1], 10) == [4, 3, 3]
+  assert sum(allocate([5, 0, 2], 7)) == 7
+
+
+def test_calls_of_a_group_read_different_chunks():
+  calls = ChunkPlanner(context_tokens=120000, max_questions_per_call=25).plan([8000] * 5, 40)
+  assert len(calls) == 2
+  assert set(calls[0].chunk_ids).isdisjoint(calls[1].chunk_ids)
+  assert sorted(calls[0].chunk_ids + calls[1].chunk_ids) == [0, 1, 2, 3, 4]
+  assert sum(call.count for call in calls) == 40
+  assert all(call.count <= 25 for call in calls)
+
+
+def test_quota_past_the_chunks_is_left_to_topups():
+  calls = ChunkPlanner(context_tokens=120000, max_questions_per_call=25).plan([8000], 60)
+  assert [(call.chunk_ids, call.count) for call in calls] == [([0], 60)]
+
+
+def test_small_quota_is_one_call():
+  calls = ChunkPlanner(context_tokens=120000, max_questions_per_call=25).plan([8000] * 5, 10)
+  assert [(call.chunk_ids, call.count) for call in calls] == [([0, 1, 2, 3, 4], 10)]